@@ -1,16 +1,34 @@
 """__init__.py"""
 
+import inspect
 from fastapi import FastAPI, Request
 from starlette.middleware.sessions import SessionMiddleware
-from api.app import router
+from api.app import router, note_model
 from api.routers.user_api import router as user_router
 from api.routers.note_api import router as note_router
-from api.database import create_database, create_tables, drop_db
+from api.settings import DB_BACKEND
+from api.database import (
+    drop_db, init_engine, dispose_engine, init_async_engine, dispose_async_engine
+)
+from api.migrations import check_schema_version, check_schema_version_async
+from api.utils.autosave import start_autosave_flusher, stop_autosave_flusher
+from api.utils.compression import CompressionMiddleware
+from api.utils.feed import change_feed
+from api.utils.metrics import MetricsMiddleware
+from api.utils.passwords import password_hasher
+from api.utils.responses import FastJSONResponse
+from api.utils.session_store import start_session_sweeper, stop_session_sweeper
+from api.utils.sync import start_tombstone_compactor, stop_tombstone_compactor
+from api.utils.touch import start_touch_flusher, stop_touch_flusher
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Session middleware configuration
 app.add_middleware(SessionMiddleware, secret_key="mysecretkey2024")
+# Compresses the responses per Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+# Outermost, times the whole request
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(router)
 app.include_router(user_router)
@@ -21,15 +39,43 @@ app.include_router(note_router)
 async def before_first_request():
     """This function is called when the application is Starting down"""
     print("Starting app")
-    create_database()
-    create_tables()
+    if DB_BACKEND == "async":
+        init_async_engine()
+        await check_schema_version_async()
+    else:
+        init_engine()
+        check_schema_version()
+    start_session_sweeper()
+    start_touch_flusher()
+    start_autosave_flusher(note_model.save_autosaves)
+    start_tombstone_compactor(note_model.compact_tombstones)
     print("Application startup complete")
 
+async def _shutdown_step(name: str, step, *args):
+    """Run one shutdown step, a failure is printed and the next steps
+    still run so every resource is released."""
+    try:
+        result = step(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        print(f"Shutdown step {name} failed: {e}")
+
 @app.on_event("shutdown")
 async def before_close_app():
     """This function is called when the application is shutting down"""
     print("Closing app")
     # drop_db()
+    await _shutdown_step("session sweeper", stop_session_sweeper)
+    await _shutdown_step("tombstone compactor", stop_tombstone_compactor)
+    await _shutdown_step("change feed", change_feed.close)
+    # acknowledged autosaves are written before anything is closed
+    await _shutdown_step("autosave flush", stop_autosave_flusher, note_model.save_autosaves)
+    # writes the buffered last opened/read times, before the engines go
+    await _shutdown_step("touch flush", stop_touch_flusher)
+    await _shutdown_step("password hasher", password_hasher.shutdown)
+    await _shutdown_step("engine", dispose_engine)
+    await _shutdown_step("async engine", dispose_async_engine)
     print("Application shutdown complete")
 
 
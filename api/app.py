@@ -2,14 +2,23 @@
 
 from typing import Union
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from api.models.users import User
-from api.models.notes import Note
+from api.models.users import AsyncUser
+from api.models.notes import AsyncNote
+from api.database import get_pool_stats
+from api.utils.autosave import autosaves
+from api.utils.cache import get_cache_stats
+from api.utils.feed import change_feed
+from api.utils.metrics import metrics
+from api.utils.passwords import password_hasher
+from api.utils.session_store import session_store, call_store
+from api.utils.touch import get_touch_stats
 
 
 router = APIRouter()
-user_model = User()
-note_model = Note()
+user_model = AsyncUser()
+note_model = AsyncNote()
 
 
 class Test(BaseModel):
@@ -30,6 +39,57 @@ async def home():
     return {"message": "Welcome in Home"}
 
 
+# The stats keep the stdlib encoder, its float formatting differs from orjson
+@router.get("/db/pool", response_class=JSONResponse)
+async def db_pool_stats():
+    """Connection pool usage, to help sizing the pool"""
+    return get_pool_stats()
+
+
+@router.get("/cache/stats", response_class=JSONResponse)
+async def cache_stats():
+    """Hit/miss counters of the note and user caches"""
+    return get_cache_stats()
+
+
+@router.get("/auth/hasher", response_class=JSONResponse)
+async def password_hasher_stats():
+    """Queue and latency of the password hashing pool, to help sizing it"""
+    return password_hasher.stats()
+
+
+@router.get("/auth/sessions", response_class=JSONResponse)
+async def session_store_stats():
+    """Open, created, rotated and expired server-side sessions"""
+    return await call_store(session_store.stats)
+
+
+@router.get("/db/touches", response_class=JSONResponse)
+async def touch_buffer_stats():
+    """Pending, coalesced and written last opened/read times"""
+    return get_touch_stats()
+
+
+@router.get("/db/autosaves", response_class=JSONResponse)
+async def autosave_stats():
+    """Pending, absorbed and flushed autosaves of notes"""
+    return autosaves.stats()
+
+
+@router.get("/feed/stats", response_class=JSONResponse)
+async def change_feed_stats():
+    """Subscribers, published, replayed and overflowed note change events"""
+    return change_feed.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, latency and SQL metrics in Prometheus text format"""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 # @router.get("/index")
 # async def index(
 #     id: Union[int, None]
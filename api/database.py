@@ -1,17 +1,57 @@
 """database.py"""
 
+import os
+from time import perf_counter
 from datetime import datetime
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from threading import Lock
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from uuid import uuid4
+from typing import Optional
+from sqlalchemy.orm import DeclarativeBase, sessionmaker, scoped_session, deferred
 # from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, Column, Integer, String, Text, text, DateTime
-
-USERNAME = "root"
-PASSWORD = "Abdallah%402004"
-HOST = "localhost"
-DATABASE = "note_db"
+from sqlalchemy import (
+    create_engine, event, inspect, Column, Integer, String, Text, text, DateTime, Index,
+    LargeBinary
+)
+from sqlalchemy.dialects.mysql import LONGBLOB
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, StaticPool
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine, create_async_engine, async_sessionmaker, async_scoped_session
+)
+from starlette.concurrency import run_in_threadpool
+from api.settings import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DB_BACKEND, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_ECHO
+)
 
 # Base = declarative_base()
 
+SEARCH_FIELDS = ("title", "content")
+
+# SQLite: an external content FTS5 table kept in sync by triggers, so every
+# insert/update/delete made by the Note model updates the index too
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+    "title, content, content='notes', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN "
+    "INSERT INTO notes_fts(rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); END",
+    # only writes of the indexed columns, not the last_read touches
+    "CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content "
+    "ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO notes_fts(rowid, title, content) "
+    "VALUES (new.id, new.title, new.content); END",
+)
+
+
 class Base(DeclarativeBase):
     """Base class for all models"""
 
@@ -24,11 +64,22 @@ class UserDb(Base):
     username = Column(String(50), unique=True, nullable=False)
     email = Column(String(100), unique=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
-    session_id = Column(String(40), default=None)
     time_created = Column(DateTime, default=datetime.now)
     last_opened = Column(DateTime, default=datetime.now)
     date_of_birth = Column(Text, default=None)
     description = Column(String(500), default=None)
+    # Bumped on every write to the profile or to the notes of the user,
+    # the version of their ETags
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class SchemaVersionDb(Base):
+    """This class records the migrations applied to the database."""
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(200), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
 
 
 class NoteDb(Base):
@@ -38,45 +89,417 @@ class NoteDb(Base):
     id = Column(Integer, autoincrement=True, primary_key=True)
     user_id = Column(Integer, nullable=False)
     title = Column(String(100))
+    # Full text, or only its preview when compressed into `content_data`
     content = Column(Text, nullable=False)
     time_created = Column(DateTime)
     time_edition = Column(DateTime)
+    # Codec of `content_data`, see `api.utils.codec`, NULL for plain notes
+    content_codec = Column(String(8), default=None)
+    # Loaded only when read, and only compressed notes have one
+    content_data = deferred(Column(
+        LargeBinary().with_variant(LONGBLOB(), "mysql"), default=None
+    ))
+    # Last time the note was read, written behind by `api.utils.touch`
+    last_read = Column(DateTime, default=None)
+    # users.version of the owner, bumped by the transaction that last wrote
+    # the note, so its writes are ordered as they commit (incremental sync)
+    owner_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # owner listing, most recently edited first
+        Index("ix_notes_user_id_time_edition", "user_id", "time_edition"),
+        # changes of one owner since a sync cursor
+        Index("ix_notes_user_id_owner_version", "user_id", "owner_version"),
+        # MySQL only, SQLite gets its FTS5 table from `create_search_index`
+        *(
+            Index(
+                f"ix_notes_{field}_fulltext", field, mysql_prefix="FULLTEXT"
+            ).ddl_if(dialect="mysql")
+            for field in SEARCH_FIELDS
+        ),
+    )
+
+
+class NoteTombstoneDb(Base):
+    """This class records the deleted notes, for the incremental sync."""
+    __tablename__ = 'note_tombstones'
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    note_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    time_deleted = Column(DateTime, nullable=False, default=datetime.now)
+    # users.version of the owner bumped by the deleting transaction
+    owner_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # deletions of one owner since a sync cursor
+        Index(
+            "ix_note_tombstones_user_id_owner_version", "user_id", "owner_version", "id"
+        ),
+        # compaction past the retention window
+        Index("ix_note_tombstones_time_deleted", "time_deleted"),
+    )
+
+
+# MySQL DATETIME columns keep no fraction of a second and round it away
+_WHOLE_SECONDS = make_url(DATABASE_URL).get_backend_name() == "mysql"
+
+
+def stored_time(value: Optional[datetime]) -> Optional[datetime]:
+    """`value` at the precision of the DateTime columns.
+
+    Write times go through it before they are written, so the time
+    answered to the client (ETags, autosaves, feed events) is the stored one.
+    """
+    if value is None or not _WHOLE_SECONDS:
+        return value
+    return value.replace(microsecond=0)
+
+
+class PoolStats:
+    """Counters about how long callers wait for a pooled connection."""
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        """Record one connection checkout and its wait time."""
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def to_dict(self) -> dict:
+        """Return the wait time counters as a dict"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_time_total_ms": round(self.total_wait * 1000, 3),
+                "wait_time_avg_ms": round(
+                    self.total_wait * 1000 / self.checkouts, 3
+                ) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _TimedPoolMixin:
+    """Measures the time spent waiting for a pooled connection."""
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """QueuePool that records its connection wait times."""
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records its connection wait times."""
+
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_engine_lock = Lock()
+
+# Every request gets its own scope key, see `get_db`
+_request_scope: ContextVar[Optional[str]] = ContextVar("request_scope", default=None)
 
+SessionLocal = sessionmaker()
+ScopedSession = scoped_session(SessionLocal, scopefunc=_request_scope.get)
 
-def create_engine_and_connect():
-    """Creates the engine and connects to the database."""
-    return create_engine(
-        f'mysql+mysqlconnector://{USERNAME}:{PASSWORD}@{HOST}/{DATABASE}'
+AsyncSessionLocal = async_sessionmaker(expire_on_commit=False)
+AsyncScopedSession = async_scoped_session(
+    AsyncSessionLocal, scopefunc=_request_scope.get
+)
+
+
+def get_async_url(url: str = DATABASE_URL) -> URL:
+    """Return the async driver URL matching the configured database URL."""
+    if ASYNC_DATABASE_URL:
+        return make_url(ASYNC_DATABASE_URL)
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver known for '{url.drivername}'")
+    return url.set(drivername=driver)
+
+def _engine_options(url: URL, pool_class: type) -> dict:
+    """Return the create_engine options for the configured pool."""
+    options = {"echo": DB_ECHO}
+
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # one shared connection, otherwise every checkout is a new empty db
+            options["poolclass"] = StaticPool
+            return options
+
+    options.update(
+        poolclass=pool_class,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
     )
+    return options
+
+def _set_sqlite_pragmas(url: URL, engine: Engine):
+    """WAL and a busy timeout on a SQLite file, so readers do not block the
+    writer and the writers of several worker processes wait for each other
+    instead of failing with "database is locked"."""
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+def create_engine_and_connect(url: str = DATABASE_URL) -> Engine:
+    """Creates the engine with the configured connection pool."""
+    url = make_url(url)
+    engine = create_engine(url, **_engine_options(url, TimedQueuePool))
+    _set_sqlite_pragmas(url, engine)
+    return engine
+
+def create_async_engine_and_connect(url: Optional[str] = None) -> AsyncEngine:
+    """Creates the async engine with the configured connection pool."""
+    url = make_url(url) if url else get_async_url()
+    engine = create_async_engine(url, **_engine_options(url, TimedAsyncQueuePool))
+    _set_sqlite_pragmas(url, engine.sync_engine)
+    return engine
+
+def init_engine() -> Engine:
+    """Builds the process-wide engine once and binds the session factory to it."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine_and_connect()
+            SessionLocal.configure(bind=_engine)
+    return _engine
+
+def get_engine() -> Engine:
+    """Return the process-wide engine, building it on first use."""
+    if _engine is None:
+        return init_engine()
+    return _engine
+
+def init_async_engine() -> AsyncEngine:
+    """Builds the process-wide async engine once and binds the session factory."""
+    global _async_engine
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine_and_connect()
+            AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+def get_async_engine() -> AsyncEngine:
+    """Return the process-wide async engine, building it on first use."""
+    if _async_engine is None:
+        return init_async_engine()
+    return _async_engine
+
+def dispose_engine():
+    """Closes every pooled connection of the process-wide engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            ScopedSession.remove()
+            _engine.dispose()
+            _engine = None
+
+async def dispose_async_engine():
+    """Closes every pooled connection of the process-wide async engine."""
+    global _async_engine
+    engine, _async_engine = _async_engine, None
+    if engine is not None:
+        await engine.dispose()
+
+def _reset_engines_after_fork():
+    """A forked child gets fresh pools, the parent keeps the connections."""
+    global _engine_lock
+    _engine_lock = Lock()
+    if _engine is not None:
+        _engine.dispose(close=False)
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+def get_pool_stats() -> dict:
+    """Return the connection pool usage of the process-wide engine."""
+    if DB_BACKEND == "async":
+        pool = get_async_engine().sync_engine.pool
+    else:
+        pool = get_engine().pool
+    stats = {"backend": DB_BACKEND, "pool": pool.__class__.__name__, "status": pool.status()}
+
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+
+    stats.update(pool_stats.to_dict())
+    return stats
 
 def create_database():
     """Creates the database schema."""
-    engine = create_engine(
-        f'mysql+mysqlconnector://{USERNAME}:{PASSWORD}@{HOST}/'
-    )
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != "mysql":
+        return
+    engine = create_engine(url.set(database=""))
     with engine.connect() as connection:
         connection.execute(
-            text(f"CREATE DATABASE IF NOT EXISTS {DATABASE}")
+            text(f"CREATE DATABASE IF NOT EXISTS {url.database}")
         )
-    print("Database 'note_db' created or already exists.")
+    engine.dispose()
+    print(f"Database '{url.database}' created or already exists.")
+
+def create_search_index(connection: Connection):
+    """Creates the SQLite FTS5 index of the notes table if it is missing."""
+    if connection.dialect.name != "sqlite":
+        return
+
+    existed = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'"
+    )).first()
+    for statement in SQLITE_FTS_DDL:
+        connection.execute(text(statement))
+    if not existed:
+        # index the notes written before the FTS table existed
+        connection.execute(text(
+            "INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"
+        ))
 
-def create_tables():
-    """Creates the tables in the database schema"""
-    engine = create_engine_and_connect()
-    Base.metadata.create_all(engine)
-    print("Tables created or already exist.")
+def create_missing_indexes(connection: Connection):
+    """Adds the indexes declared on the models to already existing tables."""
+    existing = set(inspect(connection).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
 
 def drop_db():
     """Drops the database and all tables in it"""
-    engine = create_engine_and_connect()
-    with engine.connect() as connection:
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != "mysql":
+        with get_engine().begin() as connection:
+            if connection.dialect.name == "sqlite":
+                connection.execute(text("DROP TABLE IF EXISTS notes_fts"))
+            Base.metadata.drop_all(connection)
+        print("Tables dropped.")
+        return
+    with get_engine().connect() as connection:
         connection.execute(
-            text(f"DROP DATABASE IF EXISTS {DATABASE}")
+            text(f"DROP DATABASE IF EXISTS {url.database}")
         )
-    print("Database 'note_db' dropped.")
+    print(f"Database '{url.database}' dropped.")
 
 def get_session():
-    """Return a new session."""
-    engine = create_engine_and_connect()
-    session = sessionmaker(bind=engine)
-    return session()
+    """Return the request-scoped session registry.
+
+    Calling it (or any Session method on it) resolves to the session
+    of the current request, see `get_db`.
+    """
+    return ScopedSession
+
+async def get_db():
+    """FastAPI dependency that gives each request its own session."""
+    _request_scope.set(uuid4().hex)
+
+    if DB_BACKEND == "async":
+        get_async_engine()
+        session = AsyncScopedSession()
+        try:
+            yield session
+        finally:
+            await AsyncScopedSession.remove()
+        return
+
+    get_engine()
+    session = ScopedSession()
+    try:
+        yield session
+    finally:
+        ScopedSession.remove()
+
+@asynccontextmanager
+async def session_scope():
+    """Gives the block its own sessions, like a request, for background tasks."""
+    if DB_BACKEND == "async":
+        get_async_engine()
+    else:
+        get_engine()
+    token = _request_scope.set(uuid4().hex)
+    try:
+        yield
+    finally:
+        if DB_BACKEND == "async":
+            await AsyncScopedSession.remove()
+        else:
+            ScopedSession.remove()
+        _request_scope.reset(token)
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking model method without stalling the event loop.
+
+    With the async backend the method runs on the request's AsyncSession
+    (`self.sess` resolves to its sync facade), otherwise it runs in the
+    threadpool on the request's scoped session.
+    """
+    if DB_BACKEND != "async":
+        return await run_in_threadpool(func, *args, **kwargs)
+
+    def call(sync_session):
+        ScopedSession.registry.set(sync_session)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ScopedSession.registry.clear()
+
+    return await AsyncScopedSession().run_sync(call)
+
+def iter_partitions(statement, size: int):
+    """Yield the rows of `statement` in chunks from a server-side cursor.
+
+    Uses its own session, so it can outlive the request that started it
+    (e.g. a StreamingResponse body).
+    """
+    get_engine()
+    session = SessionLocal()
+    try:
+        result = session.execute(statement.execution_options(yield_per=size))
+        for rows in result.partitions():
+            yield rows
+    finally:
+        session.close()
+
+async def aiter_partitions(statement, size: int):
+    """Async version of `iter_partitions` on the async engine."""
+    get_async_engine()
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(statement.execution_options(yield_per=size))
+        async for rows in result.partitions():
+            yield rows
@@ -0,0 +1,278 @@
+"""migrations.py
+
+Versioned schema migrations.
+
+    python migrate.py upgrade   # create the database and apply migrations
+    python migrate.py current   # print the applied and expected versions
+    python migrate.py recompress [batch_size]  # store notes per NOTE_CODEC
+
+Workers never run DDL at startup, they only compare the version recorded in
+the `schema_version` table with SCHEMA_VERSION (see `check_schema_version`).
+"""
+
+from datetime import datetime
+from typing import Callable, Optional
+from sqlalchemy import bindparam, func, insert, inspect, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from api.settings import DB_AUTO_MIGRATE, NOTE_RECOMPRESS_BATCH
+from api.database import (
+    Base, UserDb, NoteDb, NoteTombstoneDb, SchemaVersionDb, create_database,
+    create_missing_indexes, create_search_index, get_engine, get_async_engine
+)
+from api.utils.codec import note_codec, pack_content, unpack_content
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised when the database schema is older than the code."""
+
+
+def _create_tables(connection: Connection):
+    """Users and notes tables, as created by the first releases."""
+    Base.metadata.create_all(
+        connection, tables=[UserDb.__table__, NoteDb.__table__]
+    )
+
+
+def _add_query_indexes(connection: Connection):
+    """Indexes of the hot queries: owner listing, session lookup, search."""
+    create_missing_indexes(connection)
+    create_search_index(connection)
+
+
+def _add_user_version(connection: Connection):
+    """Version counter of the user ETags."""
+    columns = [column["name"] for column in inspect(connection).get_columns("users")]
+    if "version" not in columns:
+        connection.execute(text(
+            "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+        ))
+
+
+def _add_note_last_read(connection: Connection):
+    """Last read time of the notes."""
+    columns = [column["name"] for column in inspect(connection).get_columns("notes")]
+    if "last_read" not in columns:
+        connection.execute(text("ALTER TABLE notes ADD COLUMN last_read DATETIME"))
+
+
+def _create_note_tombstones(connection: Connection):
+    """Tombstones of the deleted notes, for the incremental sync."""
+    NoteTombstoneDb.__table__.create(connection, checkfirst=True)
+
+
+def _add_note_content_codec(connection: Connection):
+    """Compressed content of the large notes."""
+    columns = [column["name"] for column in inspect(connection).get_columns("notes")]
+    if "content_codec" not in columns:
+        connection.execute(text("ALTER TABLE notes ADD COLUMN content_codec VARCHAR(8)"))
+    if "content_data" not in columns:
+        blob = NoteDb.__table__.c.content_data.type.compile(dialect=connection.dialect)
+        connection.execute(text(f"ALTER TABLE notes ADD COLUMN content_data {blob}"))
+
+
+def _narrow_search_trigger(connection: Connection):
+    """SQLite FTS5 update trigger limited to the title and content."""
+    if connection.dialect.name != "sqlite":
+        return
+    connection.execute(text("DROP TRIGGER IF EXISTS notes_fts_au"))
+    create_search_index(connection)
+
+
+def _drop_index(connection: Connection, table: str, name: str):
+    """Drops an index if it exists."""
+    if name in [index["name"] for index in inspect(connection).get_indexes(table)]:
+        on_table = f" ON {table}" if connection.dialect.name == "mysql" else ""
+        connection.execute(text(f"DROP INDEX {name}{on_table}"))
+
+
+def _drop_user_session_id(connection: Connection):
+    """users.session_id, replaced by the session store."""
+    _drop_index(connection, "users", "ix_users_session_id")
+    columns = [column["name"] for column in inspect(connection).get_columns("users")]
+    if "session_id" in columns:
+        connection.execute(text("ALTER TABLE users DROP COLUMN session_id"))
+
+
+
+def _add_owner_versions(connection: Connection):
+    """Owner version of the note writes and deletions, the incremental
+    sync is keyed on it instead of the edition and deletion times."""
+    for table in ("notes", "note_tombstones"):
+        columns = [column["name"] for column in inspect(connection).get_columns(table)]
+        if "owner_version" not in columns:
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN owner_version INTEGER NOT NULL DEFAULT 0"
+            ))
+    _drop_index(connection, "note_tombstones", "ix_note_tombstones_user_id_time_deleted")
+    create_missing_indexes(connection)
+
+
+# (version, description, upgrade), every step must be safe to re-run on a
+# database created before versions were recorded
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "create users and notes tables", _create_tables),
+    (2, "add owner, session and full-text indexes", _add_query_indexes),
+    (3, "add users.version", _add_user_version),
+    (4, "add notes.last_read", _add_note_last_read),
+    (5, "create note_tombstones table", _create_note_tombstones),
+    (6, "add notes.content_codec and notes.content_data", _add_note_content_codec),
+    (7, "fire the notes_fts update trigger on title and content only", _narrow_search_trigger),
+    (8, "drop users.session_id", _drop_user_session_id),
+    (9, "add notes.owner_version and note_tombstones.owner_version", _add_owner_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection: Connection) -> Optional[int]:
+    """Return the applied schema version, None for an unversioned database."""
+    try:
+        return connection.execute(
+            select(func.max(SchemaVersionDb.version))
+        ).scalar()
+    except SQLAlchemyError:
+        connection.rollback()
+        return None
+
+
+def apply_migrations(connection: Connection) -> list:
+    """Apply the migrations newer than the recorded version."""
+    if not inspect(connection).has_table(SchemaVersionDb.__tablename__):
+        SchemaVersionDb.__table__.create(connection)
+
+    version = current_version(connection) or 0
+    applied = []
+
+    for number, description, upgrade in MIGRATIONS:
+        if number <= version:
+            continue
+        upgrade(connection)
+        connection.execute(insert(SchemaVersionDb).values(
+            version=number, description=description, applied_at=datetime.now()
+        ))
+        applied.append(number)
+        print(f"Applied migration {number}: {description}")
+
+    return applied
+
+
+def upgrade() -> list:
+    """Create the database if needed and apply every pending migration."""
+    create_database()
+    with get_engine().begin() as connection:
+        return apply_migrations(connection)
+
+
+def _check(version: Optional[int]):
+    """Compare the recorded version with the one this code expects."""
+    if version == SCHEMA_VERSION:
+        return
+    if version is None or version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, expected {SCHEMA_VERSION}. "
+            "Run `python migrate.py upgrade` or set DB_AUTO_MIGRATE=true."
+        )
+    print(
+        f"Database schema version {version} is newer than this code "
+        f"({SCHEMA_VERSION}), continuing."
+    )
+
+
+def check_schema_version():
+    """Startup check, a single cheap query when the schema is up to date."""
+    with get_engine().connect() as connection:
+        version = current_version(connection)
+
+    if version != SCHEMA_VERSION and DB_AUTO_MIGRATE:
+        upgrade()
+        return
+    _check(version)
+
+
+async def check_schema_version_async():
+    """`check_schema_version` through the async engine."""
+    async with get_async_engine().connect() as connection:
+        version = await connection.run_sync(current_version)
+
+    if version != SCHEMA_VERSION and DB_AUTO_MIGRATE:
+        async with get_async_engine().begin() as connection:
+            await connection.run_sync(apply_migrations)
+        return
+    _check(version)
+
+
+def recompress_notes(batch_size: int = NOTE_RECOMPRESS_BATCH) -> int:
+    """Rewrite the stored notes per the current NOTE_CODEC settings.
+
+    Notes are read in id order, `batch_size` per transaction. Large plain
+    notes get compressed, notes of another codec re-encoded (or stored
+    plain with NOTE_CODEC=none). Each rewrite is conditioned on the edition
+    time it read and keeps it, so a note edited meanwhile keeps its edit
+    and the ETags and sync cursors stay valid.
+    """
+    notes = NoteDb.__table__
+    target = note_codec.name if note_codec is not None else None
+    statement = update(notes).where(
+        notes.c.id == bindparam("row_id"),
+        notes.c.time_edition.is_not_distinct_from(bindparam("version"))
+    ).values(
+        content=bindparam("new_content"),
+        content_codec=bindparam("new_codec"),
+        content_data=bindparam("new_data"),
+    )
+
+    last_id, rewritten = 0, 0
+    while True:
+        with get_engine().begin() as connection:
+            rows = connection.execute(
+                select(
+                    notes.c.id, notes.c.time_edition, notes.c.content,
+                    notes.c.content_codec, notes.c.content_data
+                ).where(notes.c.id > last_id).order_by(notes.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            changes = []
+            for row in rows:
+                if row.content_codec == target:
+                    continue
+                packed = pack_content(
+                    unpack_content(row.content, row.content_codec, row.content_data)
+                )
+                if packed["content_codec"] == row.content_codec:
+                    continue
+                changes.append({
+                    "row_id": row.id,
+                    "version": row.time_edition,
+                    "new_content": packed["content"],
+                    "new_codec": packed["content_codec"],
+                    "new_data": packed["content_data"],
+                })
+            if changes:
+                rewritten += connection.execute(statement, changes).rowcount
+        print(f"Recompressed {rewritten} notes, up to id {last_id}")
+
+    return rewritten
+
+
+def main(argv: list) -> int:
+    """Command line entry point."""
+    command = argv[1] if len(argv) > 1 else "upgrade"
+
+    if command == "upgrade":
+        applied = upgrade()
+        print(f"Schema at version {SCHEMA_VERSION} ({len(applied)} migrations applied).")
+    elif command == "current":
+        with get_engine().connect() as connection:
+            print(f"applied: {current_version(connection)}, expected: {SCHEMA_VERSION}")
+    elif command == "recompress":
+        batch_size = int(argv[2]) if len(argv) > 2 else NOTE_RECOMPRESS_BATCH
+        codec = note_codec.name if note_codec is not None else "none"
+        print(f"{recompress_notes(batch_size)} notes rewritten, codec {codec}.")
+    else:
+        print(__doc__)
+        return 2
+    return 0
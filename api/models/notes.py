@@ -1,11 +1,28 @@
 """notes.py"""
 
 from typing import Union, Optional
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 # from sqlalchemy import and_, or_
 from pydantic import BaseModel, Field
+from sqlalchemy import select, insert, update, delete, exists
 from sqlalchemy.exc import SQLAlchemyError
-from api.database import NoteDb, get_session
+from sqlalchemy.orm.attributes import set_committed_value
+from api.database import (
+    NoteDb, NoteTombstoneDb, UserDb, get_session, run_db, session_scope,
+    iter_partitions, aiter_partitions, stored_time
+)
+from api.settings import DB_BACKEND, EXPORT_CHUNK_SIZE, SYNC_TOMBSTONE_RETENTION
+from api.utils.search import search_query, ranked_search
+from api.utils.pagination import InvalidCursorError, paginate, page_size, keyset_filter
+from api.utils.autosave import autosaves
+from api.utils.cache import note_cache, user_cache
+from api.utils.codec import pack_content, unpack_content, unpack_note, unpack_rows
+from api.utils.etag import PreconditionFailedError
+from api.utils.patch import InvalidPatchError, apply_edits
+from api.utils.feed import change_feed
+from api.utils.export import EXPORT_COLUMNS, encode_chunks, aencode_chunks
+from api.utils.responses import ShapeEncoder
+from api.utils.sync import encode_sync_cursor, decode_sync_cursor
 
 
 
@@ -22,6 +39,77 @@ class NoteDetails(BaseNote):
     id: int
 
 
+class NotePage(BaseModel):
+    """One page of notes and the cursor of the next page"""
+    items: list[NoteDetails]
+    next_cursor: Optional[str] = None
+
+
+# Columns of NoteDetails in its field order, selected by the read-only
+# list and search queries instead of whole NoteDb entities, then the
+# stored form of the content, removed by `unpack_note`
+NOTE_COLUMNS = (
+    NoteDb.user_id, NoteDb.title, NoteDb.content,
+    NoteDb.time_created, NoteDb.time_edition, NoteDb.id,
+    NoteDb.content_codec, NoteDb.content_data
+)
+note_encoder = ShapeEncoder(NoteDetails)
+
+# Version of the owner of the note being written, read after
+# `_bump_owner_versions` in the same transaction
+OWNER_VERSION = select(UserDb.version).where(
+    UserDb.id == NoteDb.user_id
+).scalar_subquery()
+
+
+class NoteUpdate(BaseModel):
+    """One item of a bulk note update"""
+    id: int
+    content: str
+    title: Optional[str] = None
+    time_edition: Optional[datetime] = Field(default_factory=datetime.now)
+
+
+class NoteEdit(BaseModel):
+    """Replace `[start:end]` of the base content with `text`"""
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    text: str = ""
+
+
+class NotePatch(BaseModel):
+    """Edits of the content of a note against its `base_time_edition`"""
+    base_time_edition: Optional[datetime] = None
+    edits: list[NoteEdit] = []
+    title: Optional[str] = None
+
+
+class NoteVersion(BaseModel):
+    """Version of a note after a patch"""
+    id: int
+    time_edition: datetime
+
+
+class NoteTombstone(BaseModel):
+    """A note deleted since a sync cursor"""
+    id: int
+    time_deleted: datetime
+
+
+class NoteChanges(BaseModel):
+    """Notes created or edited and notes deleted since a sync cursor"""
+    notes: list[NoteDetails]
+    deleted: list[NoteTombstone]
+    next_cursor: str
+    has_more: bool
+
+
+class BulkResult(BaseModel):
+    """Outcome of one item of a bulk request, in request order"""
+    id: Optional[int] = None
+    status: str
+
+
 class Note():
     """Note Class"""
     def __init__(self):
@@ -74,11 +162,19 @@ class Note():
     #         self.sess.close()
 
     def get_note_by_id(self, note_id: int):
-        """Fetches a note by its id."""
+        """Fetches a note by its id, through the note cache, with its
+        pending autosave."""
+        cached = note_cache.get(note_id)
+        if cached is not None:
+            return autosaves.overlay(note_id, dict(cached))
+
+        token = note_cache.snapshot()
         try:
             note = self.sess.query(NoteDb).filter(NoteDb.id == note_id).first()
             if note:
-                return note
+                note = self.convert_class_note_to_object(note)
+                note_cache.set(note_id, note, token)
+                return autosaves.overlay(note_id, dict(note))
             return f"Note (id = {note_id}) not found"
         except Exception as e:
             raise SQLAlchemyError(
@@ -87,10 +183,30 @@ class Note():
         finally:
             self.sess.close()
 
+    def get_note_version(self, note_id: int) -> Optional[datetime]:
+        """Fetches the edition time of a note, without its content."""
+        pending = autosaves.get(note_id)
+        if pending is not None:
+            return pending["time_edition"]
+        cached = note_cache.get(note_id)
+        if cached is not None:
+            return cached["time_edition"]
+
+        try:
+            return self.sess.scalar(
+                select(NoteDb.time_edition).where(NoteDb.id == note_id)
+            )
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while fetching note version: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
     def get_all_notes(self, skip: Optional[int] = None, limit: Optional[int] = None):
-        """Fetches all notes from the database."""
+        """Fetches all notes from the database, as dicts."""
         try:
-            notes = self.sess.query(NoteDb)
+            notes = self.sess.query(*NOTE_COLUMNS)
 
             if skip is not None and limit is not None:
                 notes = notes.offset(skip).limit(limit)
@@ -99,7 +215,7 @@ class Note():
             elif skip and limit is None:
                 notes = notes.offset(skip).limit(10)
 
-            notes = notes.all()
+            notes = [unpack_note(note._asdict()) for note in notes]
 
             if not notes:
                 return "No notes found"
@@ -114,30 +230,51 @@ class Note():
         finally:
             self.sess.close()
 
-    def search_notes(
-        self, field: str, query: str,
-        skip: Optional[int] = None, limit: Optional[int] = None
+    def get_notes_by_owner(
+        self, user_id: int, skip: Optional[int] = None, limit: Optional[int] = None
     ):
-        """Search notes based on field and query."""
+        """Fetches the notes of one user as dicts, most recently edited first."""
         try:
-            notes = None
-            q = query.lower()
-
-            notes = self.sess.query(NoteDb).filter(
-                getattr(NoteDb, field).like(f'%{q}%')
+            notes = self.sess.query(*NOTE_COLUMNS).filter(
+                NoteDb.user_id == user_id
+            ).order_by(
+                NoteDb.time_edition.desc(), NoteDb.id.desc()
             )
 
+            if skip is not None or limit is not None:
+                notes = notes.offset(skip or 0).limit(limit or 10)
+
+            notes = [unpack_note(note._asdict()) for note in notes]
+
             if not notes:
                 return "No notes found"
+            return notes
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while fetching notes of user: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
+    def search_notes(
+        self, field: str, query: str,
+        skip: Optional[int] = None, limit: Optional[int] = None,
+        user_id: Optional[int] = None
+    ):
+        """Search notes based on field and query as dicts, ranked by relevance."""
+        try:
+            notes = search_query(
+                self.sess, field, query, user_id
+            ).with_entities(*NOTE_COLUMNS)
 
             if skip is not None and limit is not None:
-                notes = notes.offset(skip).limit(limit).all()
+                notes = notes.offset(skip).limit(limit)
             elif skip is not None:
-                notes = notes.offset(skip).limit(10).all()
+                notes = notes.offset(skip).limit(10)
             elif limit is not None:
-                notes = notes.limit(limit).all()
-            else:
-                notes = notes.all()
+                notes = notes.limit(limit)
+
+            notes = [unpack_note(note._asdict()) for note in notes]
 
             if not notes:
                 return f"No notes found '{query}' for the search query."
@@ -152,6 +289,157 @@ class Note():
         finally:
             self.sess.close()
 
+    def get_notes_page(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        """Fetches one page of notes, as dicts, after `cursor`, ordered by id."""
+        try:
+            notes, next_cursor = paginate(
+                self.sess.query(*NOTE_COLUMNS), [NoteDb.id], cursor, limit
+            )
+            notes = [unpack_note(note) for note in notes]
+            return {"items": notes, "next_cursor": next_cursor}
+        except InvalidCursorError:
+            raise
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while fetching notes page: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
+    def get_owner_notes_page(
+        self, user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        """Fetches one page of the notes of one user as dicts, newest edit first."""
+        try:
+            notes, next_cursor = paginate(
+                self.sess.query(*NOTE_COLUMNS).filter(NoteDb.user_id == user_id),
+                [NoteDb.time_edition, NoteDb.id], cursor, limit, descending=True
+            )
+            notes = [unpack_note(note) for note in notes]
+            return {"items": notes, "next_cursor": next_cursor}
+        except InvalidCursorError:
+            raise
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while fetching notes page of user: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
+    def search_notes_page(
+        self, field: str, query: str,
+        cursor: Optional[str] = None, limit: Optional[int] = None,
+        user_id: Optional[int] = None
+    ) -> dict:
+        """Search one page of notes, as dicts, after `cursor`, ranked by relevance."""
+        try:
+            notes, rank = ranked_search(self.sess, field, query, user_id)
+            notes, next_cursor = paginate(
+                notes.with_entities(*NOTE_COLUMNS), [rank, NoteDb.id], cursor, limit
+            )
+            notes = [unpack_note(note) for note in notes]
+            return {"items": notes, "next_cursor": next_cursor}
+        except InvalidCursorError:
+            raise
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while searching notes page: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
+    def get_changes(
+        self, user_id: int, since: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        """Fetches the notes of one user created or edited after the `since`
+        cursor, and the tombstones of the ones deleted, one page of each.
+
+        Both are read in (owner version, id) order on the owner indexes, so
+        a sync costs what changed, not the size of the account. Every write
+        bumps the owner version under the lock of the owner row, the
+        versions follow the commits and a cursor never skips a write.
+        """
+        notes_key, deleted_key = decode_sync_cursor(since)
+        size = page_size(limit)
+        try:
+            if deleted_key is None:
+                # only the deletions committed after this read
+                version = self.sess.scalar(
+                    select(UserDb.version).where(UserDb.id == user_id)
+                )
+                deleted_key = [(version or 0) + 1, 0]
+
+            note_keys = [NoteDb.owner_version, NoteDb.id]
+            notes = self.sess.query(*NOTE_COLUMNS, NoteDb.owner_version).filter(
+                NoteDb.user_id == user_id
+            )
+            if notes_key is not None:
+                notes = notes.filter(keyset_filter(note_keys, notes_key))
+            notes = [
+                unpack_note(note._asdict())
+                for note in notes.order_by(*note_keys).limit(size + 1)
+            ]
+
+            deleted_keys = [NoteTombstoneDb.owner_version, NoteTombstoneDb.id]
+            tombstones = self.sess.execute(
+                select(
+                    NoteTombstoneDb.note_id, NoteTombstoneDb.time_deleted, *deleted_keys
+                ).where(
+                    NoteTombstoneDb.user_id == user_id,
+                    keyset_filter(deleted_keys, deleted_key),
+                    # the id was reused by a later note of the owner
+                    ~exists().where(
+                        NoteDb.id == NoteTombstoneDb.note_id,
+                        NoteDb.user_id == NoteTombstoneDb.user_id
+                    )
+                ).order_by(*deleted_keys).limit(size + 1)
+            ).all()
+
+            has_more = len(notes) > size or len(tombstones) > size
+            notes, tombstones = notes[:size], tombstones[:size]
+            if notes:
+                notes_key = [notes[-1]["owner_version"], notes[-1]["id"]]
+            for note in notes:
+                del note["owner_version"]
+            if tombstones:
+                deleted_key = list(tombstones[-1][2:])
+
+            return {
+                "notes": notes,
+                "deleted": [
+                    {"id": note_id, "time_deleted": time_deleted}
+                    for note_id, time_deleted, _, _ in tombstones
+                ],
+                "next_cursor": encode_sync_cursor(notes_key, deleted_key),
+                "has_more": has_more,
+            }
+        except Exception as e:
+            raise SQLAlchemyError(
+                f"An error occurred while fetching note changes: {e}"
+            ) from e
+        finally:
+            self.sess.close()
+
+    def compact_tombstones(self, retention: float = SYNC_TOMBSTONE_RETENTION) -> int:
+        """Deletes the tombstones older than `retention` seconds."""
+        try:
+            dropped = self.sess.execute(
+                delete(NoteTombstoneDb).where(
+                    NoteTombstoneDb.time_deleted
+                    < datetime.now() - timedelta(seconds=retention)
+                ),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            self.sess.commit()
+            return dropped
+        except Exception as e:
+            self.sess.rollback()
+            raise SQLAlchemyError(f"An error occurred while compacting tombstones: {e}") from e
+        finally:
+            self.sess.close()
+
     # def get_notes(
     #     self,
     #     field: str,
@@ -205,18 +493,25 @@ class Note():
     def create_a_new_note(self, item: BaseNote) -> NoteDetails:
         """Creates a new note with the given content and title."""
         try:
+            owners = self._bump_owner_versions(user_ids=[item.user_id])
             new_note = NoteDb(
                 user_id=item.user_id,
-                content=item.content,
+                **pack_content(item.content),
                 title=item.title,
-                time_created=item.time_created,
-                time_edition=item.time_edition,
+                time_created=stored_time(item.time_created),
+                time_edition=stored_time(item.time_edition),
+                owner_version=owners.get(item.user_id, 0),
             )
 
             self.sess.add(new_note)
             self.sess.commit()
-            
+            self._forget_owners(owners)
+
             self.sess.refresh(new_note)
+            self._show_content(new_note, item.content)
+            change_feed.publish(
+                "created", new_note.id, new_note.user_id, new_note.time_edition
+            )
 
             return new_note
         except Exception as e:
@@ -230,49 +525,375 @@ class Note():
         content: str,
         time_edition: datetime,
         title: Union[str, None] = None,
+        expected_time_edition: Optional[datetime] = None,
     ) -> NoteDetails:
-        """Updates the note data in the database."""
+        """Updates the note data in the database.
+
+        With `expected_time_edition` (from `If-Match`) the note is only
+        updated while it is still at that version, in the same UPDATE.
+        """
+        time_edition = stored_time(time_edition)
         try:
-            old_note = self.sess.query(NoteDb).filter(
-                NoteDb.id == note_id
-            ).first()
+            notes = self.sess.query(NoteDb).filter(NoteDb.id == note_id)
+            if expected_time_edition is not None:
+                notes = notes.filter(NoteDb.time_edition == expected_time_edition)
 
-            if old_note is None:
-                raise ValueError(f"No note found with id {note_id}")
+            owners = self._bump_owner_versions(note_ids=[note_id])
+            updated = notes.update(
+                {
+                    **pack_content(content), "title": title,
+                    "time_edition": time_edition, "owner_version": OWNER_VERSION,
+                },
+                synchronize_session=False
+            )
 
-            old_note.content = content
-            old_note.title = title
-            old_note.time_edition = time_edition
+            if not updated:
+                self.sess.rollback()
+                if expected_time_edition is not None and self.sess.get(NoteDb, note_id):
+                    raise PreconditionFailedError(
+                        f"Note {note_id} was modified since the given version"
+                    )
+                raise ValueError(f"No note found with id {note_id}")
 
             self.sess.commit()
-            self.sess.refresh(old_note)
+            note_cache.delete(note_id)
+            self._forget_owners(owners)
 
-            return old_note
+            note = self.sess.get(NoteDb, note_id)
+            self._show_content(note, content)
+            change_feed.publish("updated", note_id, note.user_id, note.time_edition)
+            return note
+        except (PreconditionFailedError, ValueError):
+            raise
         except Exception as e:
             raise SQLAlchemyError(f"An error occurred while updating note data: {e}") from e
         finally:
             self.sess.close()
 
+    def patch_note(
+        self,
+        note_id: int,
+        patch: NotePatch,
+        time_edition: datetime,
+    ) -> Optional[dict]:
+        """Applies content edits made against `patch.base_time_edition`.
+
+        The base content comes from the note cache when it holds that
+        version. The new version is written by one UPDATE conditioned on
+        the base version, so a concurrent write makes it fail with
+        PreconditionFailedError. Returns None for an unknown note.
+        """
+        time_edition = stored_time(time_edition)
+        try:
+            base = patch.base_time_edition
+            note = note_cache.get(note_id)
+            if note is None or note["time_edition"] != base:
+                note = self.sess.execute(
+                    select(
+                        NoteDb.content, NoteDb.time_edition,
+                        NoteDb.content_codec, NoteDb.content_data
+                    ).where(NoteDb.id == note_id)
+                ).mappings().first()
+            if note is None:
+                return None
+            if note["time_edition"] != base:
+                raise PreconditionFailedError(
+                    f"Note {note_id} was modified since the given version"
+                )
+            note = unpack_note(dict(note))
+
+            values = {
+                **pack_content(apply_edits(note["content"], patch.edits)),
+                "time_edition": time_edition,
+                "owner_version": OWNER_VERSION,
+            }
+            if patch.title is not None:
+                values["title"] = patch.title
+
+            owners = self._bump_owner_versions(note_ids=[note_id])
+            updated = self.sess.execute(
+                update(NoteDb).where(
+                    NoteDb.id == note_id, NoteDb.time_edition == base
+                ).values(**values),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+            if not updated:
+                self.sess.rollback()
+                raise PreconditionFailedError(
+                    f"Note {note_id} was modified since the given version"
+                )
+
+            self.sess.commit()
+            note_cache.delete(note_id)
+            self._forget_owners(owners)
+            for user_id in owners:
+                change_feed.publish("updated", note_id, user_id, time_edition)
+            return {"id": note_id, "time_edition": time_edition}
+        except (PreconditionFailedError, InvalidPatchError):
+            self.sess.rollback()
+            raise
+        except Exception as e:
+            self.sess.rollback()
+            raise SQLAlchemyError(f"An error occurred while patching note: {e}") from e
+        finally:
+            self.sess.close()
+
     def delete_note_by_id(self, note_id: int):
         """Deletes a note by its ID."""
         try:
-            self.sess.query(NoteDb).filter(
+            owners = self._bump_owner_versions(note_ids=[note_id])
+            deleted = self.sess.query(NoteDb).filter(
                 NoteDb.id == note_id
             ).delete()
+            if deleted:
+                self._add_tombstones({note_id: user_id for user_id in owners}, owners)
             self.sess.commit()
+            note_cache.delete(note_id)
+            self._forget_owners(owners)
+            if deleted:
+                for user_id in owners:
+                    change_feed.publish("deleted", note_id, user_id)
         except Exception as e:
             self.sess.rollback()
             raise SQLAlchemyError(f"An error occurred while deleting note by ID: {e}") from e
         finally:
             self.sess.close()
 
+    def create_notes(self, items: list[BaseNote]) -> list[BulkResult]:
+        """Creates many notes in one transaction with a bulk INSERT."""
+        if not items:
+            return []
+        try:
+            rows = [
+                {
+                    "user_id": item.user_id,
+                    **pack_content(item.content),
+                    "title": item.title,
+                    "time_created": stored_time(item.time_created),
+                    "time_edition": stored_time(item.time_edition),
+                }
+                for item in items
+            ]
+
+            owners = self._bump_owner_versions(user_ids=[row["user_id"] for row in rows])
+            for row in rows:
+                row["owner_version"] = owners.get(row["user_id"], 0)
+
+            dialect = self.sess.get_bind().dialect
+            if dialect.insert_executemany_returning_sort_by_parameter_order:
+                ids = self.sess.scalars(
+                    insert(NoteDb).returning(
+                        NoteDb.id, sort_by_parameter_order=True
+                    ),
+                    rows
+                ).all()
+            else:
+                # no RETURNING on this backend, the unit of work still
+                # batches the INSERTs it can and gives back each id
+                notes = [NoteDb(**row) for row in rows]
+                self.sess.add_all(notes)
+                self.sess.flush()
+                ids = [note.id for note in notes]
+
+            self.sess.commit()
+            self._forget_owners(owners)
+            for note_id, row in zip(ids, rows):
+                change_feed.publish("created", note_id, row["user_id"], row["time_edition"])
+            return [BulkResult(id=note_id, status="created") for note_id in ids]
+        except Exception as e:
+            self.sess.rollback()
+            raise SQLAlchemyError(f"An error occurred while creating notes: {e}") from e
+        finally:
+            self.sess.close()
+
+    def update_notes(self, items: list[NoteUpdate]) -> list[BulkResult]:
+        """Updates many notes in one transaction with an executemany UPDATE."""
+        if not items:
+            return []
+        try:
+            ids = {item.id for item in items}
+            # id -> owner of the notes that exist
+            existing = dict(self.sess.execute(
+                select(NoteDb.id, NoteDb.user_id).where(NoteDb.id.in_(ids))
+            ).all())
+
+            # last write wins when one id shows up twice in the batch
+            rows = {
+                item.id: {
+                    "id": item.id,
+                    **pack_content(item.content),
+                    "title": item.title,
+                    "time_edition": stored_time(item.time_edition),
+                }
+                for item in items if item.id in existing
+            }
+            owners = self._bump_owner_versions(note_ids=list(rows))
+            for note_id, row in rows.items():
+                row["owner_version"] = owners.get(existing[note_id], 0)
+            if rows:
+                self.sess.execute(update(NoteDb), list(rows.values()))
+            self.sess.commit()
+
+            for note_id in rows:
+                note_cache.delete(note_id)
+            self._forget_owners(owners)
+            for note_id, row in rows.items():
+                change_feed.publish(
+                    "updated", note_id, existing[note_id], row["time_edition"]
+                )
+
+            return [
+                BulkResult(
+                    id=item.id,
+                    status="updated" if item.id in existing else "not_found"
+                )
+                for item in items
+            ]
+        except Exception as e:
+            self.sess.rollback()
+            raise SQLAlchemyError(f"An error occurred while updating notes: {e}") from e
+        finally:
+            self.sess.close()
+
+    def delete_notes(self, note_ids: list[int]) -> list[BulkResult]:
+        """Deletes many notes in one transaction with DELETE ... WHERE id IN."""
+        if not note_ids:
+            return []
+        try:
+            ids = set(note_ids)
+            # id -> owner of the notes that exist
+            existing = dict(self.sess.execute(
+                select(NoteDb.id, NoteDb.user_id).where(NoteDb.id.in_(ids))
+            ).all())
+
+            owners = self._bump_owner_versions(note_ids=list(existing))
+            if existing:
+                self.sess.execute(
+                    delete(NoteDb).where(NoteDb.id.in_(list(existing))),
+                    execution_options={"synchronize_session": False}
+                )
+                self._add_tombstones(existing, owners)
+            self.sess.commit()
+
+            for note_id, user_id in existing.items():
+                note_cache.delete(note_id)
+                change_feed.publish("deleted", note_id, user_id)
+            self._forget_owners(owners)
+
+            return [
+                BulkResult(
+                    id=note_id,
+                    status="deleted" if note_id in existing else "not_found"
+                )
+                for note_id in note_ids
+            ]
+        except Exception as e:
+            self.sess.rollback()
+            raise SQLAlchemyError(f"An error occurred while deleting notes: {e}") from e
+        finally:
+            self.sess.close()
+
+    def _bump_owner_versions(self, note_ids=(), user_ids=()) -> dict:
+        """Bumps the version of the owners of written notes, in the
+        current transaction, so their ETags change. Returns the new
+        version of each owner, the owner rows stay locked until commit."""
+        owners = set(user_ids)
+        if note_ids:
+            owners.update(self.sess.scalars(
+                select(NoteDb.user_id).where(NoteDb.id.in_(note_ids)).distinct()
+            ))
+        owners.discard(None)
+        if not owners:
+            return {}
+        self.sess.execute(
+            update(UserDb).where(UserDb.id.in_(owners)).values(
+                version=UserDb.version + 1
+            ),
+            execution_options={"synchronize_session": False}
+        )
+        return dict(self.sess.execute(
+            select(UserDb.id, UserDb.version).where(UserDb.id.in_(owners))
+        ).all())
+
+    def _add_tombstones(self, owners: dict, versions: dict):
+        """Records the deletion of notes (id -> owner), in the current
+        transaction, for the incremental sync, with the bumped owner
+        `versions`."""
+        now = datetime.now()
+        rows = [
+            {
+                "note_id": note_id, "user_id": user_id, "time_deleted": now,
+                "owner_version": versions.get(user_id, 0),
+            }
+            for note_id, user_id in owners.items() if user_id is not None
+        ]
+        if rows:
+            self.sess.execute(insert(NoteTombstoneDb), rows)
+
+    @staticmethod
+    def _show_content(note: NoteDb, content: str):
+        """Puts the full text on an entity whose content was just written
+        packed, without marking it modified."""
+        set_committed_value(note, "content", content)
+        set_committed_value(note, "content_codec", None)
+        set_committed_value(note, "content_data", None)
+
+    @staticmethod
+    def _forget_owners(owners: set):
+        """Drops the cached owners after their version was bumped."""
+        for user_id in owners:
+            user_cache.delete(user_id)
+
+    @classmethod
+    def export_statement(
+        cls,
+        user_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        """Select the exported columns, then the stored form of the content
+        (see `unpack_export`), filtered by owner and edition time."""
+        statement = select(
+            *[getattr(NoteDb, column) for column in EXPORT_COLUMNS],
+            NoteDb.content_codec, NoteDb.content_data
+        ).order_by(NoteDb.id)
+
+        if user_id is not None:
+            statement = statement.where(NoteDb.user_id == user_id)
+        if since is not None:
+            statement = statement.where(NoteDb.time_edition >= since)
+        if until is not None:
+            statement = statement.where(NoteDb.time_edition < until)
+        return statement
+
+    def export_notes(
+        self,
+        fmt: str = "ndjson",
+        user_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        """Stream the notes as NDJSON or CSV chunks, memory stays flat."""
+        statement = self.export_statement(user_id, since, until)
+        chunks = iter_partitions(statement, EXPORT_CHUNK_SIZE)
+        return encode_chunks((self.unpack_export(rows) for rows in chunks), fmt)
+
+    @staticmethod
+    def unpack_export(rows) -> list:
+        """Exported rows with the full text of their content."""
+        return unpack_rows(rows, EXPORT_COLUMNS.index("content"))
+
     def convert_class_note_to_object(cls, note: NoteDb) -> dict:
         """Converts a Note_db object to a Note dict"""
+        content = note.content
+        if note.content_codec is not None:
+            # loads the deferred compressed content, of these notes only
+            content = unpack_content(content, note.content_codec, note.content_data)
         return {
             "id": note.id,
             "user_id": note.user_id,
             "title": note.title,
-            "content": note.content,
+            "content": content,
             "time_created": note.time_created,
             "time_edition": note.time_edition,
         }
@@ -294,3 +915,175 @@ class Note():
 
     # def create_note(self, ):
     #     pass
+
+
+class AsyncNote(Note):
+    """Note Class for the async routes, queries never block the event loop"""
+    async def get_note_by_id(self, note_id: int):
+        return await run_db(super().get_note_by_id, note_id)
+
+    async def get_note_version(self, note_id: int) -> Optional[datetime]:
+        return await run_db(super().get_note_version, note_id)
+
+    async def get_all_notes(self, skip: Optional[int] = None, limit: Optional[int] = None):
+        return await run_db(super().get_all_notes, skip=skip, limit=limit)
+
+    async def get_notes_by_owner(
+        self, user_id: int, skip: Optional[int] = None, limit: Optional[int] = None
+    ):
+        return await run_db(
+            super().get_notes_by_owner, user_id=user_id, skip=skip, limit=limit
+        )
+
+    async def get_owner_notes_page(
+        self, user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        return await run_db(
+            super().get_owner_notes_page, user_id=user_id, cursor=cursor, limit=limit
+        )
+
+    async def search_notes(
+        self, field: str, query: str,
+        skip: Optional[int] = None, limit: Optional[int] = None,
+        user_id: Optional[int] = None
+    ):
+        return await run_db(
+            super().search_notes, field=field, query=query, skip=skip,
+            limit=limit, user_id=user_id
+        )
+
+    async def get_notes_page(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        return await run_db(super().get_notes_page, cursor=cursor, limit=limit)
+
+    async def search_notes_page(
+        self, field: str, query: str,
+        cursor: Optional[str] = None, limit: Optional[int] = None,
+        user_id: Optional[int] = None
+    ) -> dict:
+        return await run_db(
+            super().search_notes_page, field=field, query=query,
+            cursor=cursor, limit=limit, user_id=user_id
+        )
+
+    async def get_changes(
+        self, user_id: int, since: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        return await run_db(super().get_changes, user_id, since=since, limit=limit)
+
+    async def compact_tombstones(self, retention: float = SYNC_TOMBSTONE_RETENTION) -> int:
+        async with session_scope():
+            return await run_db(super().compact_tombstones, retention)
+
+    async def create_a_new_note(self, item: BaseNote) -> NoteDetails:
+        return await run_db(super().create_a_new_note, item)
+
+    async def update_note_data(
+        self,
+        note_id: int,
+        content: str,
+        time_edition: datetime,
+        title: Union[str, None] = None,
+        expected_time_edition: Optional[datetime] = None,
+    ) -> NoteDetails:
+        await self.save_autosaves([note_id])
+        return await run_db(
+            super().update_note_data, note_id=note_id, content=content,
+            time_edition=time_edition, title=title,
+            expected_time_edition=expected_time_edition
+        )
+
+    async def patch_note(
+        self, note_id: int, patch: NotePatch, time_edition: datetime
+    ) -> Optional[dict]:
+        await self.save_autosaves([note_id])
+        return await run_db(super().patch_note, note_id, patch, time_edition)
+
+    async def autosave_note(
+        self,
+        note_id: int,
+        content: str,
+        time_edition: datetime,
+        title: Union[str, None] = None,
+        expected_time_edition: Optional[datetime] = None,
+    ) -> dict:
+        """Holds an update of a note for AUTOSAVE_WINDOW seconds, a later
+        autosave of the note replaces it. Writes through when autosaves
+        are disabled or the buffer is full."""
+        # the time the flush will store, answered in the ETag meanwhile
+        time_edition = stored_time(time_edition)
+        note = await self.get_note_by_id(note_id)
+        if not isinstance(note, dict):
+            raise ValueError(f"No note found with id {note_id}")
+        if (
+            expected_time_edition is not None
+            and note["time_edition"] != expected_time_edition
+        ):
+            raise PreconditionFailedError(
+                f"Note {note_id} was modified since the given version"
+            )
+        if autosaves.enabled and autosaves.accept(note_id, content, title, time_edition):
+            return autosaves.overlay(note_id, note)
+        updated = await self.update_note_data(
+            note_id=note_id, content=content, time_edition=time_edition,
+            title=title, expected_time_edition=expected_time_edition
+        )
+        return self.convert_class_note_to_object(updated)
+
+    async def save_autosaves(self, note_ids: Optional[list[int]] = None) -> int:
+        """Writes the pending autosaves (of `note_ids`, else all) with one
+        batched UPDATE, in a session of their own."""
+        if note_ids is not None and not any(
+            autosaves.get(note_id) for note_id in note_ids
+        ):
+            return 0
+        async with autosaves.flushing:
+            rows = autosaves.take(note_ids)
+            if not rows:
+                return 0
+            try:
+                async with session_scope():
+                    await run_db(
+                        super().update_notes, [NoteUpdate(**row) for row in rows]
+                    )
+            except Exception:
+                autosaves.restore(rows)
+                raise
+            autosaves.done(rows)
+            return len(rows)
+
+    async def delete_note_by_id(self, note_id: int):
+        autosaves.discard([note_id])
+        return await run_db(super().delete_note_by_id, note_id)
+
+    async def create_notes(self, items: list[BaseNote]) -> list[BulkResult]:
+        return await run_db(super().create_notes, items)
+
+    async def update_notes(self, items: list[NoteUpdate]) -> list[BulkResult]:
+        await self.save_autosaves([item.id for item in items])
+        return await run_db(super().update_notes, items)
+
+    async def delete_notes(self, note_ids: list[int]) -> list[BulkResult]:
+        autosaves.discard(note_ids)
+        return await run_db(super().delete_notes, note_ids)
+
+    def export_notes(
+        self,
+        fmt: str = "ndjson",
+        user_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        if DB_BACKEND != "async":
+            # a sync iterator, StreamingResponse runs it in the threadpool
+            return super().export_notes(fmt, user_id, since, until)
+        statement = self.export_statement(user_id, since, until)
+        return aencode_chunks(
+            self._aunpack_export(aiter_partitions(statement, EXPORT_CHUNK_SIZE)), fmt
+        )
+
+    async def _aunpack_export(self, chunks):
+        """Async version of the `unpack_export` of the chunks."""
+        async for rows in chunks:
+            yield self.unpack_export(rows)
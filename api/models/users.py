@@ -4,7 +4,10 @@ from typing import Union, Optional
 from pydantic import BaseModel
 from sqlalchemy import or_, and_
 from sqlalchemy.exc import SQLAlchemyError
-from api.database import UserDb, get_session
+from api.database import UserDb, get_session, run_db
+from api.utils.pagination import InvalidCursorError, paginate
+from api.utils.cache import user_cache
+from api.utils.responses import ShapeEncoder
 
 
 class BaseUser(BaseModel):
@@ -23,11 +26,24 @@ class UserIn(BaseUser):
 class UserDetails(BaseUser):
     id: int
     hashed_password: Optional[str] = None
-    session_id: Optional[str] = None
     time_created: Optional[str] = None
     last_opened: Optional[str] = None
 
 
+class UserPage(BaseModel):
+    """One page of users and the cursor of the next page"""
+    items: list[BaseUser]
+    next_cursor: Optional[str] = None
+
+
+# Columns of BaseUser in its field order, selected by the read-only
+# list queries instead of whole UserDb entities
+USER_COLUMNS = (
+    UserDb.username, UserDb.email, UserDb.date_of_birth, UserDb.description
+)
+user_encoder = ShapeEncoder(BaseUser)
+
+
 class User():
     """User Class"""
     def __init__(self):
@@ -51,37 +67,36 @@ class User():
         # ]
 
     def get_user_by_id(self, user_id):
-        """Get user by id function"""
+        """Get user by id function, through the user cache"""
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
+
+        token = user_cache.snapshot()
         try:
             user = self.sess.query(UserDb).filter(
                 UserDb.id == user_id
             ).first()
+            if user:
+                user = self.convert_class_user_to_object(user)
+                user_cache.set(user_id, user, token)
+                return dict(user)
             return user
         except SQLAlchemyError as e:
             raise SQLAlchemyError(f"Error getting user by id: {str(e)}") from e
         finally:
             self.sess.close()
 
-    def get_user_by_session_id(self, session_id):
-        """Get user by session id function"""
-        try:
-            user = self.sess.query(UserDb).filter(
-                UserDb.session_id == session_id
-            ).first()
-            return user
-        except SQLAlchemyError as e:
-            raise SQLAlchemyError(f"Error getting user by session id: {str(e)}") from e
-        finally:
-            self.sess.close()
-
     def get_user_by_username(
         self, name: str, skip: Optional[int] = 0, limit: Optional[int] = None
     ) -> Union[list, dict, str]:
-        """Get user by username function"""
+        """Get users by username function, as dicts"""
         try:
-            users_data = self.sess.query(UserDb).filter(
-                UserDb.username.like(f"%{name.lower()}%")
-            ).offset(skip).limit(limit).all()
+            users_data = [
+                user._asdict() for user in self.sess.query(*USER_COLUMNS).filter(
+                    UserDb.username.like(f"%{name.lower()}%")
+                ).offset(skip).limit(limit)
+            ]
 
             if not users_data:
                 return f"User with name {name} not found"
@@ -99,7 +114,7 @@ class User():
     ) -> list:
         """Get all users in list of dict"""
         try:
-            users = self.sess.query(UserDb)
+            users = self.sess.query(*USER_COLUMNS)
 
             if skip is not None and limit is not None:
                 users = users.offset(skip).limit(limit)
@@ -108,12 +123,28 @@ class User():
             elif skip is None and limit:
                 users = users.offset(0).limit(limit)
 
-            return users.all()
+            return [user._asdict() for user in users]
         except SQLAlchemyError as e:
             raise SQLAlchemyError(f"Error getting all users: {str(e)}") from e
         finally:
             self.sess.close()
 
+    def get_users_page(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        """Get one page of users, as dicts, after `cursor`, ordered by id"""
+        try:
+            users, next_cursor = paginate(
+                self.sess.query(*USER_COLUMNS), [UserDb.id], cursor, limit
+            )
+            return {"items": users, "next_cursor": next_cursor}
+        except InvalidCursorError:
+            raise
+        except SQLAlchemyError as e:
+            raise SQLAlchemyError(f"Error getting users page: {str(e)}") from e
+        finally:
+            self.sess.close()
+
     def check_if_user_exists(self, username: str, email: str) -> Optional[UserDb]:
         """Check if user exists in database"""
         try:
@@ -173,20 +204,19 @@ class User():
         try:
             user = None
 
-            if kwargs['session_id']:
-                user = self.sess.query(UserDb).filter(
-                    UserDb.session_id == kwargs['session_id']
-                ).first()
-            elif kwargs['id']:
+            if kwargs['id']:
                 user = self.sess.query(UserDb).filter(
                     UserDb.id == kwargs['id']
                 ).first()
 
             if user:
                 for key, value in kwargs.items():
-                    if key not in ['id', 'session_id'] and value is not None:
+                    if key not in ['id', 'version'] and value is not None:
                         setattr(user, key, value)
+                user.version = UserDb.version + 1
+                user_id = user.id
                 self.sess.commit()
+                user_cache.delete(user_id)
                 return True
             return False
         except SQLAlchemyError as e:
@@ -205,6 +235,7 @@ class User():
             if user:
                 self.sess.delete(user)
                 self.sess.commit()
+                user_cache.delete(user_id)
                 return True
 
             return False
@@ -222,9 +253,47 @@ class User():
             "username": user.username,
             "email": user.email,
             "hashed_password": user.hashed_password,
-            "session_id": user.session_id,
             "time_created": user.time_created,
             "last_opened": user.last_opened,
             "date_of_birth": user.date_of_birth,
             "description": user.description,
-        }
\ No newline at end of file
+            "version": user.version,
+        }
+
+
+class AsyncUser(User):
+    """User Class for the async routes, queries never block the event loop"""
+    async def get_user_by_id(self, user_id):
+        return await run_db(super().get_user_by_id, user_id)
+
+    async def get_user_by_username(
+        self, name: str, skip: Optional[int] = 0, limit: Optional[int] = None
+    ) -> Union[list, dict, str]:
+        return await run_db(super().get_user_by_username, name, skip, limit)
+
+    async def get_all_users_data(
+        self,
+        skip: Optional[int],
+        limit: Optional[int]
+    ) -> list:
+        return await run_db(super().get_all_users_data, skip, limit)
+
+    async def get_users_page(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> dict:
+        return await run_db(super().get_users_page, cursor=cursor, limit=limit)
+
+    async def check_if_user_exists(self, username: str, email: str) -> Optional[UserDb]:
+        return await run_db(super().check_if_user_exists, username, email)
+
+    async def authenticate_user(self, username: str, password: str) -> Union[dict, str]:
+        return await run_db(super().authenticate_user, username, password)
+
+    async def insert_new_user(self, **kwargs: dict):
+        return await run_db(super().insert_new_user, **kwargs)
+
+    async def update_user_account(self, kwargs: dict) -> dict:
+        return await run_db(super().update_user_account, kwargs)
+
+    async def delete_user(self, user_id: int) -> bool:
+        return await run_db(super().delete_user, user_id)
@@ -1,43 +1,193 @@
 """note_api.py"""
 
 from datetime import datetime
-from typing import Union, Optional, Annotated
-from fastapi import APIRouter, Path, Depends
+from typing import Union, Optional, Annotated, Literal
+from fastapi import APIRouter, HTTPException, Path, Depends, Body, Request
+from fastapi.responses import StreamingResponse
 from pydantic import Field
 from api.app import note_model, user_model
-from api.models.notes import BaseNote, NoteDetails
+from api.database import get_db
+from api.models.notes import (
+    BaseNote, NoteDetails, NotePage, NoteUpdate, BulkResult, NotePatch, NoteVersion,
+    NoteChanges, note_encoder
+)
+from api.settings import FEED_ENABLED, NOTE_BATCH_MAX
+from api.utils.etag import (
+    PreconditionFailedError, note_etag, parse_note_etag, owner_notes_etag,
+    if_none_match, if_match, not_modified
+)
+from api.utils.export import MEDIA_TYPES
+from api.utils.feed import stream_changes
+from api.utils.pagination import InvalidCursorError
+from api.utils.patch import InvalidPatchError
+from api.utils.responses import FastJSONResponse, RowsResponse
 from api.utils.session import SessionManager, get_session_manager
+from api.utils.sync import SyncExpiredError
+from api.utils.touch import note_touches
 
 router = APIRouter(
     prefix='/api',
-    tags=['note-api']
+    tags=['note-api'],
+    dependencies=[Depends(get_db)]
 )
 
 
+@router.get("/notes/export")
+async def export_notes(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> StreamingResponse:
+    """Stream every note as NDJSON or CSV, optionally filtered by owner and
+    by `time_edition` (`since` inclusive, `until` exclusive)."""
+    return StreamingResponse(
+        note_model.export_notes(format, user_id, since, until),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="notes.{format}"'
+        }
+    )
+
+
+@router.get("/notes/feed")
+async def note_change_feed(
+    request: Request,
+    last_event_id: Optional[str] = None,
+    session: SessionManager = Depends(get_session_manager),
+) -> StreamingResponse:
+    """Stream the changes of the notes of the current user as Server-Sent
+    Events (`created`, `updated`, `deleted`).
+
+    A client reconnecting with `Last-Event-ID` (or `last_event_id`) gets
+    the events it missed, or a `reset` event when they are no longer
+    buffered. A client too slow to read its events gets an `overflow`
+    event and is disconnected, to resume the same way.
+
+    The broker lives in the process, so the feed is off (503) when the
+    server runs several workers, see `FEED_ENABLED`.
+    """
+    if session.user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    if not FEED_ENABLED:
+        raise HTTPException(
+            status_code=503,
+            detail="The change feed is off with several workers, poll /api/notes/changes"
+        )
+    return StreamingResponse(
+        stream_changes(
+            session.user_id,
+            request.headers.get("last-event-id") or last_event_id
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/notes/changes", response_model=NoteChanges)
+async def get_note_changes(
+    since: Optional[str] = None,
+    limit: Optional[int] = None,
+    session: SessionManager = Depends(get_session_manager),
+):
+    """Notes of the current user created or edited since the `since`
+    cursor, and the ids of the ones deleted.
+
+    Without `since` every note is sent. Pass the returned `next_cursor`
+    as `since` to get what changed since, again while `has_more`. A
+    cursor older than the tombstone retention answers 410, the client
+    must then resync without `since`.
+    """
+    if session.user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    try:
+        changes = await note_model.get_changes(session.user_id, since=since, limit=limit)
+    except SyncExpiredError as e:
+        raise HTTPException(status_code=410, detail=str(e)) from e
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return RowsResponse(changes)
+
+
 @router.get("/notes/{field}")
 async def get_notes_by_field(
+    request: Request,
     field: Optional[str],
     query: Optional[str] = None,
     note_id: Optional[int] = None,
     skip: Optional[int] = None,
     limit: Optional[int] = None,
-) -> Union[dict, NoteDetails, list[NoteDetails]]:
-    """Get notes by field"""
+    cursor: Optional[str] = None,
+    mine: bool = False,
+    session: SessionManager = Depends(get_session_manager),
+) -> Union[dict, NoteDetails, list[NoteDetails], NotePage]:
+    """Get notes by field
+
+    Pass `cursor` (empty for the first page) to page `list`, `me`, `title`
+    and `content` by keyset instead of `skip`, the response then carries
+    the `next_cursor` of the following page. `me` lists the notes of the
+    current user, `mine` limits a search to them.
+
+    `id` and `me` answer with an ETag and honor `If-None-Match`, the 304
+    is decided from the note version or the user version alone.
+    """
     # if field not in ['title', 'content', 'list', 'id']:
     #     raise ValueError(
     #         f"Invalid field: {field}. Must be 'title', 'content', 'list' or 'id'."
     #     )
     try:
         notes_data = None
+        owner_id = None
+        etag = None
+
+        if field == 'me' or mine:
+            owner_id = session.user_id
+            if owner_id is None:
+                raise HTTPException(status_code=401, detail="Not logged in")
+
+        if field == 'me':
+            owner = await session.get_user()
+            if owner is not None:
+                etag = owner_notes_etag(request, owner_id, owner["version"])
+                if if_none_match(request, etag):
+                    return not_modified(etag)
 
         match field:
             case 'id' if note_id:
-                notes_data = note_model.get_note_by_id(note_id)
+                if request.headers.get("if-none-match"):
+                    version = await note_model.get_note_version(note_id)
+                    if version is not None and if_none_match(
+                        request, note_etag(note_id, version)
+                    ):
+                        note_touches.touch(note_id)
+                        return not_modified(note_etag(note_id, version))
+                notes_data = await note_model.get_note_by_id(note_id)
+                if isinstance(notes_data, dict):
+                    note_touches.touch(note_id)
+                    etag = note_etag(note_id, notes_data["time_edition"])
+                    # in NoteDetails field order, like the list rows
+                    notes_data = note_encoder.project(notes_data)
+            case 'list' if cursor is not None:
+                notes_data = await note_model.get_notes_page(cursor=cursor, limit=limit)
             case 'list':
-                notes_data = note_model.get_all_notes(skip=skip, limit=limit)
+                notes_data = await note_model.get_all_notes(skip=skip, limit=limit)
+            case 'me' if cursor is not None:
+                notes_data = await note_model.get_owner_notes_page(
+                    user_id=owner_id, cursor=cursor, limit=limit
+                )
+            case 'me':
+                notes_data = await note_model.get_notes_by_owner(
+                    user_id=owner_id, skip=skip, limit=limit
+                )
+            case 'title' | 'content' if query and cursor is not None:
+                notes_data = await note_model.search_notes_page(
+                    field=field, query=query, cursor=cursor, limit=limit,
+                    user_id=owner_id
+                )
             case 'title' | 'content' if query:
-                notes_data = note_model.search_notes(
-                    field=field, query=query, skip=skip, limit=limit
+                notes_data = await note_model.search_notes(
+                    field=field, query=query, skip=skip, limit=limit,
+                    user_id=owner_id
                 )
             # case 'content' if query:
             #     notes_data = note_model.search_notes(
@@ -46,12 +196,20 @@ async def get_notes_by_field(
             case 'title' | 'content' if query is None:
                 notes_data = f"Invalid query for field: {field}."
             case _:
-                notes_data = f"Invalid field: {field}. Must be 'title', 'content', 'list' or 'id'."
+                notes_data = f"Invalid field: {field}. Must be 'title', 'content', 'list', 'me' or 'id'."
 
         if isinstance(notes_data, str):
             return {"message": notes_data}
 
-        return notes_data
+        # plain rows of the read-only queries, already shaped like the models
+        response = RowsResponse(notes_data)
+        if etag:
+            response.headers["ETag"] = etag
+        return response
+    except HTTPException as http_ex:
+        raise http_ex
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
     except Exception as e:
         raise ValueError(
             f"Invalid field: {field}. Must be 'title', 'content', 'list' or 'id'."
@@ -69,9 +227,50 @@ async def create_note(
     if item.user_id == 0 or not item.user_id:
         item.user_id = session.user_id
 
-    new_note = note_model.create_a_new_note(item)
+    new_note = await note_model.create_a_new_note(item)
+
+    response = note_encoder.response(new_note)
+    response.headers["ETag"] = note_etag(new_note.id, new_note.time_edition)
+    return response
+
+
+def check_batch_size(items: list):
+    """Reject batches larger than NOTE_BATCH_MAX."""
+    if len(items) > NOTE_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many notes in one batch: {len(items)} > {NOTE_BATCH_MAX}"
+        )
+
+
+@router.post("/notes/bulk/create", response_model=list[BulkResult])
+async def create_notes_in_bulk(
+    items: list[BaseNote], session: SessionManager = Depends(get_session_manager)
+) -> list[BulkResult]:
+    """Create many notes in one transaction."""
+    check_batch_size(items)
+
+    for item in items:
+        if item.user_id == 0 or not item.user_id:
+            item.user_id = session.user_id
+
+    return await note_model.create_notes(items)
+
+
+@router.put("/notes/bulk/update", response_model=list[BulkResult])
+async def update_notes_in_bulk(items: list[NoteUpdate]) -> list[BulkResult]:
+    """Update many notes in one transaction."""
+    check_batch_size(items)
+    return await note_model.update_notes(items)
 
-    return new_note
+
+@router.delete("/notes/bulk/delete", response_model=list[BulkResult])
+async def delete_notes_in_bulk(
+    note_ids: Annotated[list[int], Body()]
+) -> list[BulkResult]:
+    """Delete many notes permanently in one transaction."""
+    check_batch_size(note_ids)
+    return await note_model.delete_notes(note_ids)
 
 
 @router.put("/notes/{note_id}/update", response_model=NoteDetails)
@@ -84,15 +283,87 @@ async def update_note(
         )
     ],
     content: str,
+    request: Request,
     time_edition: datetime = Depends(datetime.now),
     title: Optional[str] = None,
+    autosave: bool = False,
 ):
-    """Update a note."""
-    updated_note = note_model.update_note_data(
-        note_id=note_id, content=content,
-        title=title, time_edition=time_edition
-    )
-    return updated_note
+    """Update a note.
+
+    With `If-Match: <ETag>` the update only applies while the note is
+    still at that version, otherwise it answers 412.
+
+    With `autosave=true` the update is acknowledged at once and written
+    within AUTOSAVE_WINDOW seconds, a later autosave of the note replaces
+    it. Reads by id see it meanwhile.
+    """
+    try:
+        etag = if_match(request)
+        expected_time_edition = parse_note_etag(etag, note_id) if etag else None
+        if autosave:
+            updated_note = await note_model.autosave_note(
+                note_id=note_id, content=content,
+                title=title, time_edition=time_edition,
+                expected_time_edition=expected_time_edition
+            )
+            response = note_encoder.response(updated_note)
+            response.headers["ETag"] = note_etag(note_id, updated_note["time_edition"])
+            return response
+        updated_note = await note_model.update_note_data(
+            note_id=note_id, content=content,
+            title=title, time_edition=time_edition,
+            expected_time_edition=expected_time_edition
+        )
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e)) from e
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+
+    response = note_encoder.response(updated_note)
+    response.headers["ETag"] = note_etag(updated_note.id, updated_note.time_edition)
+    return response
+
+
+@router.patch("/notes/{note_id}", response_model=NoteVersion)
+async def patch_note(
+    note_id: Annotated[
+        int, Path(
+            title="The ID of the note to be patched",
+            description="The ID of the note to be patched",
+            gt=0
+        )
+    ],
+    patch: NotePatch,
+    request: Request,
+    time_edition: datetime = Depends(datetime.now),
+):
+    """Apply edits to the content of a note.
+
+    The edits are made against the version given by `base_time_edition`
+    or by `If-Match: <ETag>`, answers 412 when the note moved on. Only the
+    new version is returned, with its ETag.
+    """
+    try:
+        etag = if_match(request)
+        if etag:
+            patch.base_time_edition = parse_note_etag(etag, note_id)
+        if patch.base_time_edition is None:
+            raise HTTPException(
+                status_code=428,
+                detail="base_time_edition or If-Match is required"
+            )
+        version = await note_model.patch_note(note_id, patch, time_edition)
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e)) from e
+    except InvalidPatchError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Note (id = {note_id}) not found")
+
+    response = FastJSONResponse(version)
+    response.headers["ETag"] = note_etag(note_id, version["time_edition"])
+    return response
 
 
 @router.delete("/notes/{note_id}/delete")
@@ -106,7 +377,7 @@ async def delete_note_data_permanently(
     ]
 ) -> dict:
     """Delete note data permanently."""
-    note_model.delete_note_by_id(note_id)
+    await note_model.delete_note_by_id(note_id)
     return {
         "message": f"Note with id {note_id} has been deleted permanently."
     }
@@ -1,58 +1,76 @@
 """user_api.py"""
 
 from typing import Union, Optional, Annotated  #, List
-from uuid import uuid4
 from fastapi import APIRouter, HTTPException, Query, Path, Depends, Body, Request
 from api.app import user_model
-from api.database import UserDb
-from api.models.users import BaseUser, UserIn, UserDetails
+from api.database import get_db
+from api.models.users import BaseUser, UserIn, UserDetails, UserPage, user_encoder
+from api.utils.etag import user_etag, if_none_match, not_modified
+from api.utils.pagination import InvalidCursorError
+from api.utils.passwords import PasswordQueueFullError, password_hasher
+from api.utils.responses import RowsResponse
 from api.utils.session import SessionManager, get_session_manager
+from api.utils.session_store import session_store, call_store
 
 
 router = APIRouter(
     prefix='/api',
-    tags=['user-api']
+    tags=['user-api'],
+    dependencies=[Depends(get_db)]
 )
 
 
 @router.get("/users/{field}")
 async def get_user(
+    request: Request,
     field: Optional[str],
     user_id: Optional[int] = None,
     name: Optional[str] = None,
     skip: Optional[int] = None,
     limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     session: SessionManager = Depends(get_session_manager)
-) -> Union[str, BaseUser, list[BaseUser]]:
+) -> Union[str, BaseUser, list[BaseUser], UserPage]:
     """
     Get user by id, or
     get all users with optional filtering and pagination.
+    `list` pages by keyset when `cursor` is given (empty for the first page).
     """
     users_data: Union[str, dict, list, None] = None
     # users_data = None
 
     match field:
         case "me":
-            users_data = user_model.get_user_by_session_id(session.session_id)
+            users_data = await session.get_user()
         case "id" if user_id:
-            users_data = user_model.get_user_by_id(user_id)
+            users_data = await user_model.get_user_by_id(user_id)
         case "name" if name:
-            users_data = user_model.get_user_by_username(name, skip, limit)
+            users_data = await user_model.get_user_by_username(name, skip, limit)
+        case "list" if cursor is not None:
+            try:
+                users_data = await user_model.get_users_page(cursor, limit)
+            except InvalidCursorError as e:
+                raise HTTPException(status_code=400, detail=str(e)) from e
         case "list":
-            users_data = user_model.get_all_users_data(skip, limit)
+            users_data = await user_model.get_all_users_data(skip, limit)
         case _:
             users_data = f"Invalid field: '{field}'."
 
     if not users_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if isinstance(users_data, UserDb):
-        return users_data
+    if isinstance(users_data, list) or field == "list":
+        # plain rows of the read-only queries, already shaped like BaseUser
+        return RowsResponse(users_data)
 
-    if isinstance(users_data, list):
-        if len(users_data) == 1:
-            return users_data
-        return users_data
+    if isinstance(users_data, dict):
+        # profiles carry an ETag of the user version, 304 when unchanged
+        etag = user_etag(users_data["id"], users_data["version"])
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        response = user_encoder.response(users_data)
+        response.headers["ETag"] = etag
+        return response
 
     return {"message": users_data}
 
@@ -97,7 +115,7 @@ async def login(
         )
 
     try:
-        current_user = user_model.check_if_user_exists(username=username, email=email)
+        current_user = await user_model.check_if_user_exists(username=username, email=email)
 
         if not current_user:
             raise HTTPException(
@@ -105,19 +123,30 @@ async def login(
                 detail="Invalid username or email. user not found"
             )
 
-        if current_user.hashed_password != password:
+        matches, needs_rehash = await password_hasher.verify(
+            password, current_user.hashed_password
+        )
+        if not matches:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid password. password not correct"
             )
 
-        # Set session data for authenticated user
-        request.session["id"] = current_user.id
-        request.session["session_id"] = current_user.session_id
+        # Plaintext or outdated hash, store it with the current parameters
+        if needs_rehash:
+            await user_model.update_user_account({
+                "id": current_user.id,
+                "hashed_password": await password_hasher.hash(password),
+            })
+
+        # Open a new server-side session for the authenticated user
+        await SessionManager.login(request, current_user.id)
 
         return current_user
     except HTTPException as http_ex:
         raise http_ex
+    except PasswordQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -136,7 +165,7 @@ async def register(
 ) -> BaseUser:
     """Register a new user"""
     try:
-        existing_user = user_model.check_if_user_exists(username, email)
+        existing_user = await user_model.check_if_user_exists(username, email)
 
         if existing_user:
             error_field = "username" if existing_user.username == username else "email"
@@ -146,21 +175,21 @@ async def register(
             )
 
         # Insert new user and set session details
-        current_user = user_model.insert_new_user(
+        current_user = await user_model.insert_new_user(
             username=username,
             email=email,
-            hashed_password=password,
+            hashed_password=await password_hasher.hash(password),
             date_of_birth=date_of_birth,
             description=description,
-            session_id=str(uuid4())
         )
 
-        request.session["id"] = current_user.id
-        request.session["session_id"] = current_user.session_id
+        await SessionManager.login(request, current_user.id)
 
         return current_user
     except HTTPException as http_ex:
         raise http_ex
+    except PasswordQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -225,14 +254,18 @@ async def update_user_data(
     try:
         user_updated = None
 
-        user_dict = user_account.dict()
+        user_dict = {**user_account.dict(), "id": None}
+        if user_dict["hashed_password"]:
+            user_dict["hashed_password"] = await password_hasher.hash(
+                user_dict["hashed_password"]
+            )
 
         if isinstance(user_id, str) and user_id == 'me':
-            user_dict["session_id"] = session.session_id
+            user_dict["id"] = session.user_id
         elif isinstance(user_id, int) and user_id >= 1:
             user_dict["id"] = user_id
 
-        if user_model.update_user_account(user_dict):
+        if await user_model.update_user_account(user_dict):
             return {
                 "message": "User data updated successfully",
                 "user_data": BaseUser(
@@ -263,14 +296,22 @@ async def delete_user_account_completely(
             description="This will delete the user account completely.",
         )
     ],
-    request: Request
+    request: Request,
+    session: SessionManager = Depends(get_session_manager)
 ) -> dict:
     """Delete user Account permanently"""
-    if isinstance(user_id, str) and user_id == "me":
-        user_id = request.session.get("id")
-        request.session.clear()
-
-    if user_model.delete_user(user_id):
+    if user_id == "me":
+        user_id = session.user_id
+        await session.clear(request)
+    else:
+        # path ids arrive as str, the caches and sessions are keyed by int
+        try:
+            user_id = int(user_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid user id: {user_id}") from e
+
+    if await user_model.delete_user(user_id):
+        await call_store(session_store.delete_user, user_id)
         return {
             "message": "User account has been deleted successfully",
             "status": 200
@@ -282,8 +323,10 @@ async def delete_user_account_completely(
     }
 
 @router.delete("/users/logout")
-async def logout_user(request: Request) -> dict:
+async def logout_user(
+    request: Request, session: SessionManager = Depends(get_session_manager)
+) -> dict:
     """Logout user"""
-    request.session.clear()
+    await session.clear(request)
 
     return {"message": "User logged out successfully", "status": 200}
@@ -0,0 +1,136 @@
+"""server.py
+
+Production entry point, serves the app with several worker processes.
+
+    python serve.py                      # one worker per CPU
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The parent process applies the pending migrations (with DB_AUTO_MIGRATE)
+or checks the schema once, then closes its connections and starts the
+workers. Every worker is a fresh process that builds its own engine,
+caches and background tasks at startup. `kill -HUP <parent>` replaces the
+workers one by one (graceful reload), `kill -TTIN`/`-TTOU` adds or
+removes one.
+"""
+
+import argparse
+import os
+from typing import Optional
+import uvicorn
+from api.settings import (
+    WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_GRACEFUL_TIMEOUT, DB_AUTO_MIGRATE
+)
+
+
+def default_workers() -> int:
+    """WEB_WORKERS, or one worker per CPU."""
+    return WEB_WORKERS if WEB_WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def share_sessions(workers: int) -> Optional[str]:
+    """Make the workers share their sessions, the error when they cannot."""
+    if workers == 1:
+        return None
+    store = os.environ.get("SESSION_STORE")
+    if store is None:
+        # the memory store is per process, a session would only work on
+        # the worker that opened it
+        os.environ["SESSION_STORE"] = "sqlite"
+        print("SESSION_STORE=sqlite, shared by the workers")
+        return None
+    if store.strip().lower() == "memory":
+        return "SESSION_STORE=memory cannot be shared by several workers, use sqlite"
+    return None
+
+
+def share_caches(workers: int) -> Optional[str]:
+    """Turn the note and user caches off for several workers, the error
+    when they are asked for."""
+    if workers == 1:
+        return None
+    backend = os.environ.get("CACHE_BACKEND")
+    if backend is None:
+        # a write only clears the cache of the worker serving it, the
+        # others would answer stale notes, versions and ETags
+        os.environ["CACHE_BACKEND"] = "none"
+        print("CACHE_BACKEND=none, the memory cache is per worker")
+        return None
+    if backend.strip().lower() == "memory":
+        return "CACHE_BACKEND=memory would serve stale reads from several workers, use none"
+    return None
+
+
+def share_autosaves(workers: int) -> Optional[str]:
+    """Write the autosaves through for several workers, the error when
+    a window is asked for."""
+    if workers == 1:
+        return None
+    window = os.environ.get("AUTOSAVE_WINDOW")
+    if window is None:
+        # a held autosave flushed late by one worker would overwrite a
+        # newer write served by another
+        os.environ["AUTOSAVE_WINDOW"] = "0"
+        print("AUTOSAVE_WINDOW=0, autosaves are written through")
+        return None
+    if float(window) > 0:
+        return "AUTOSAVE_WINDOW > 0 would lose writes with several workers, use 0"
+    return None
+
+
+def share_feed(workers: int) -> Optional[str]:
+    """Turn the change feed off for several workers, the error when it
+    is asked for."""
+    if workers == 1:
+        return None
+    enabled = os.environ.get("FEED_ENABLED")
+    if enabled is None:
+        # each worker only publishes its own writes, a stream would miss
+        # the others without telling
+        os.environ["FEED_ENABLED"] = "false"
+        print("FEED_ENABLED=false, the change feed is per worker")
+        return None
+    if enabled.strip().lower() in ("1", "true", "yes", "on"):
+        return "FEED_ENABLED=true would miss the writes of other workers, use false"
+    return None
+
+
+def prepare_database():
+    """Bring the schema up to date once, before any worker starts."""
+    from api.database import dispose_engine
+    from api.migrations import upgrade, check_schema_version
+
+    try:
+        if DB_AUTO_MIGRATE:
+            upgrade()
+        else:
+            check_schema_version()
+    finally:
+        # the workers must not inherit pooled connections
+        dispose_engine()
+
+
+def main(argv: list) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv[1:])
+
+    for share in (share_sessions, share_caches, share_autosaves, share_feed):
+        error = share(args.workers)
+        if error:
+            print(error)
+            return 2
+    prepare_database()
+
+    uvicorn.run(
+        "api:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+    )
+    return 0
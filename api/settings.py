@@ -0,0 +1,137 @@
+"""settings.py"""
+
+import os
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+USERNAME = os.getenv("DB_USERNAME", "root")
+PASSWORD = os.getenv("DB_PASSWORD", "Abdallah%402004")
+HOST = os.getenv("DB_HOST", "localhost")
+DATABASE = os.getenv("DB_NAME", "note_db")
+
+# Full SQLAlchemy URL, overrides the MySQL parts above when set
+# (e.g. "sqlite:///./note_db.sqlite3" for local runs).
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"mysql+mysqlconnector://{USERNAME}:{PASSWORD}@{HOST}/{DATABASE}"
+)
+
+# "sync" runs the blocking driver in a worker thread, "async" uses
+# AsyncEngine/AsyncSession with an async driver (aiomysql, aiosqlite)
+DB_BACKEND = os.getenv("DB_BACKEND", "sync").strip().lower()
+# Defaults to DATABASE_URL with its driver swapped for the async one
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# Apply pending migrations at startup instead of refusing to start,
+# meant for local runs, production runs `python migrate.py upgrade`
+DB_AUTO_MIGRATE = _get_bool("DB_AUTO_MIGRATE", False)
+
+# Connection pool, the engine is built once per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _get_bool("DB_POOL_PRE_PING", True)
+DB_ECHO = _get_bool("DB_ECHO", False)
+
+# Pagination, `limit` of the cursor based list routes
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+# Read-through cache of notes and users by id, "none" disables it
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+
+# Largest number of notes accepted by one bulk create/update/delete
+NOTE_BATCH_MAX = int(os.getenv("NOTE_BATCH_MAX", "500"))
+
+# Rows fetched per round-trip by the streaming note export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# Encoder of the JSON responses, "orjson" when installed or the stdlib "json"
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson").strip().lower()
+
+# scrypt cost of the password hashes, raising them slows every login;
+# hashes made with other values are upgraded on the next login
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", "16384"))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+# Threads hashing passwords at once, and hashes allowed to wait for one
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_MAX = int(os.getenv("PASSWORD_QUEUE_MAX", "64"))
+
+# Server-side sessions, "memory" (per process) or "sqlite" (shared by the
+# workers of one host, in SESSION_STORE_PATH)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").strip().lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+# Seconds without a request before a session expires
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "86400"))
+# Seconds between two writes of the last seen time of one session (sqlite)
+SESSION_TOUCH_INTERVAL = float(os.getenv("SESSION_TOUCH_INTERVAL", "60"))
+# Seconds between two runs of the idle session sweeper
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# Response compression, encodings in order of preference ("br" and "zstd"
+# need the brotli and zstandard packages), empty to disable it
+COMPRESSION_ENCODINGS = [
+    name.strip().lower()
+    for name in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+    if name.strip()
+]
+# Smaller bodies are sent as they are, larger ones compressed off the loop
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_THREAD_MIN_SIZE = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", "262144"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+# Write-behind of the last opened/read times, seconds between two flushes
+# and rows buffered at most (a full buffer is flushed at once)
+TOUCH_FLUSH_INTERVAL = float(os.getenv("TOUCH_FLUSH_INTERVAL", "5"))
+TOUCH_BUFFER_MAX = int(os.getenv("TOUCH_BUFFER_MAX", "10000"))
+
+# Autosave updates (`autosave=true`), seconds a note write is held so later
+# ones replace it, 0 writes them through, and notes held at most
+AUTOSAVE_WINDOW = float(os.getenv("AUTOSAVE_WINDOW", "2"))
+AUTOSAVE_MAX_PENDING = int(os.getenv("AUTOSAVE_MAX_PENDING", "10000"))
+
+# Note change feed, off with several workers as each one only sees its own writes
+FEED_ENABLED = _get_bool("FEED_ENABLED", True)
+# Events kept for clients resuming with their last event
+# id, events queued per client before it is dropped as too slow, and
+# seconds between two keepalives of an idle stream
+FEED_REPLAY_SIZE = int(os.getenv("FEED_REPLAY_SIZE", "1000"))
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "256"))
+FEED_HEARTBEAT = float(os.getenv("FEED_HEARTBEAT", "15"))
+
+# Incremental sync, seconds deleted notes are remembered (older sync
+# cursors must resync from scratch) and seconds between two compactions
+SYNC_TOMBSTONE_RETENTION = float(os.getenv("SYNC_TOMBSTONE_RETENTION", str(30 * 86400)))
+SYNC_COMPACT_INTERVAL = float(os.getenv("SYNC_COMPACT_INTERVAL", "3600"))
+
+# Compression of the note content at rest, "zlib", "zstd" (needs the
+# zstandard package) or "none". Content of NOTE_CODEC_MIN_SIZE bytes or more
+# is stored compressed, its first NOTE_PREVIEW_SIZE characters stay plain
+# text for previews and search
+NOTE_CODEC = os.getenv("NOTE_CODEC", "none").strip().lower()
+NOTE_CODEC_MIN_SIZE = int(os.getenv("NOTE_CODEC_MIN_SIZE", "8192"))
+NOTE_PREVIEW_SIZE = int(os.getenv("NOTE_PREVIEW_SIZE", "1024"))
+NOTE_ZLIB_LEVEL = int(os.getenv("NOTE_ZLIB_LEVEL", "6"))
+NOTE_ZSTD_LEVEL = int(os.getenv("NOTE_ZSTD_LEVEL", "9"))
+# Notes rewritten per transaction by `python migrate.py recompress`
+NOTE_RECOMPRESS_BATCH = int(os.getenv("NOTE_RECOMPRESS_BATCH", "500"))
+
+# Production launcher (`python serve.py`), 0 workers means one per CPU, and
+# seconds a stopping worker may finish its requests
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.getenv("WEB_PORT", "5000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))
+WEB_GRACEFUL_TIMEOUT = float(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
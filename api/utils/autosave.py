@@ -0,0 +1,181 @@
+"""autosave.py"""
+
+import asyncio
+import os
+from datetime import datetime
+from threading import Lock
+from typing import Iterable, Optional
+from api.settings import AUTOSAVE_WINDOW, AUTOSAVE_MAX_PENDING
+from api.utils.metrics import metrics
+
+
+class AutosaveBuffer:
+    """Latest pending write of each autosaved note.
+
+    `accept` keeps one write per note, a later one replaces it and counts
+    as absorbed. `take` hands the writes to a flush, they stay readable
+    until `done` (or `restore` after a failed flush). `flushing` serializes
+    the flushes, so a direct write that flushes first always lands after
+    the autosaves of its note.
+    """
+    def __init__(self, window: float = AUTOSAVE_WINDOW, max_pending: int = AUTOSAVE_MAX_PENDING):
+        self.window = window
+        self.max_pending = max_pending
+        self._lock = Lock()
+        self._pending: dict = {}
+        self._in_flight: dict = {}
+        self.flushing = asyncio.Lock()
+        self.accepted = 0
+        self.absorbed = 0
+        self.flushed = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether autosaves are held at all."""
+        return self.window > 0
+
+    def accept(
+        self, note_id: int, content: str, title: Optional[str], time_edition: datetime
+    ) -> bool:
+        """Hold a write of a note, False when the buffer is full."""
+        with self._lock:
+            if note_id in self._pending:
+                self.absorbed += 1
+            elif len(self._pending) >= self.max_pending:
+                return False
+            self._pending[note_id] = {
+                "id": note_id,
+                "content": content,
+                "title": title,
+                "time_edition": time_edition,
+            }
+            self.accepted += 1
+            return True
+
+    def get(self, note_id: int) -> Optional[dict]:
+        """Return the pending write of a note, None without one."""
+        with self._lock:
+            return self._pending.get(note_id) or self._in_flight.get(note_id)
+
+    def overlay(self, note_id: int, note: dict) -> dict:
+        """Return `note` as its pending write will leave it."""
+        pending = self.get(note_id)
+        if pending is None:
+            return note
+        return {**note, **pending}
+
+    def take(self, note_ids: Optional[Iterable[int]] = None) -> list:
+        """Move the pending writes (of `note_ids`, else all) to a flush."""
+        with self._lock:
+            if note_ids is None:
+                rows = list(self._pending.values())
+                self._pending = {}
+            else:
+                rows = [
+                    self._pending.pop(note_id) for note_id in set(note_ids)
+                    if note_id in self._pending
+                ]
+            for row in rows:
+                self._in_flight[row["id"]] = row
+        return rows
+
+    def done(self, rows: list):
+        """Forget the writes of a successful flush."""
+        with self._lock:
+            for row in rows:
+                if self._in_flight.get(row["id"]) is row:
+                    del self._in_flight[row["id"]]
+            self.flushed += len(rows)
+
+    def restore(self, rows: list):
+        """Hold again the writes of a failed flush, unless replaced meanwhile."""
+        with self._lock:
+            for row in rows:
+                if self._in_flight.get(row["id"]) is row:
+                    del self._in_flight[row["id"]]
+                self._pending.setdefault(row["id"], row)
+            self.failures += 1
+
+    def discard(self, note_ids: Iterable[int]):
+        """Drop the pending writes of deleted notes."""
+        with self._lock:
+            for note_id in note_ids:
+                self._pending.pop(note_id, None)
+
+    def reset(self):
+        """Drop the writes inherited through a fork, the parent owns them."""
+        self._lock = Lock()
+        self._pending = {}
+        self._in_flight = {}
+
+    def stats(self) -> dict:
+        """Return the buffer counters."""
+        with self._lock:
+            return {
+                "window": self.window,
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "max_pending": self.max_pending,
+                "accepted": self.accepted,
+                "absorbed": self.absorbed,
+                "flushed": self.flushed,
+                "failures": self.failures,
+            }
+
+
+autosaves = AutosaveBuffer()
+os.register_at_fork(after_in_child=autosaves.reset)
+
+metrics.register_counter(
+    "note_autosaves_absorbed_total",
+    "Autosave writes replaced by a later one before reaching the database.",
+    lambda: autosaves.absorbed
+)
+metrics.register_counter(
+    "note_autosaves_flushed_total",
+    "Autosave writes flushed to the database.",
+    lambda: autosaves.flushed
+)
+
+
+async def _flush_forever(save, interval: float):
+    """Call `save()` every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save()
+        except Exception as e:
+            print(f"Autosave flush failed: {e}")
+
+
+_flusher: Optional[asyncio.Task] = None
+
+
+def start_autosave_flusher(save):
+    """Start the background flusher of the autosaves, once.
+
+    `save` is the coroutine function writing the pending autosaves.
+    """
+    global _flusher
+    if not autosaves.enabled:
+        return
+    if _flusher is None or _flusher.done():
+        # locks belong to the loop that first waits on them
+        autosaves.flushing = asyncio.Lock()
+        _flusher = asyncio.get_running_loop().create_task(
+            _flush_forever(save, autosaves.window)
+        )
+
+
+async def stop_autosave_flusher(save):
+    """Stop the flusher and write every acknowledged autosave."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await save()
@@ -0,0 +1,176 @@
+"""cache.py"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Optional
+from api.settings import (
+    CACHE_BACKEND, CACHE_MAX_ENTRIES, CACHE_TTL
+)
+
+
+class CacheBackend(ABC):
+    """Interface of the read-through caches in front of the models.
+
+    A reader takes a `snapshot()` before loading from the database and
+    passes it to `set()`, so a value loaded before a concurrent
+    `delete()` is never stored.
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, None when missing or expired."""
+
+    @abstractmethod
+    def snapshot(self) -> int:
+        """Return a token to pass to `set` for the value about to be loaded."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, token: Optional[int] = None):
+        """Store a value, unless `key` was invalidated after `token`."""
+
+    @abstractmethod
+    def delete(self, key: Hashable):
+        """Invalidate one entry."""
+
+    @abstractmethod
+    def clear(self):
+        """Invalidate every entry."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Return the usage counters."""
+
+
+class NullCache(CacheBackend):
+    """Cache that stores nothing, used when caching is disabled."""
+    def get(self, key):
+        return None
+
+    def snapshot(self):
+        return 0
+
+    def set(self, key, value, token=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"name": self.name, "backend": "none"}
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with a TTL, safe to share between threads."""
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        super().__init__(name)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries: OrderedDict = OrderedDict()
+        # key -> clock of its last invalidation, bounded like the entries
+        self._invalidated: OrderedDict = OrderedDict()
+        self._floor = 0
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def snapshot(self):
+        with self._lock:
+            return self._clock
+
+    def set(self, key, value, token=None):
+        with self._lock:
+            if token is not None and (
+                token < self._floor or self._invalidated.get(key, -1) > token
+            ):
+                return
+            self._entries[key] = (value, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._clock += 1
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._clock
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_entries:
+                _, clock = self._invalidated.popitem(last=False)
+                # forgotten invalidations make older loads uncacheable
+                self._floor = max(self._floor, clock)
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._clock
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+CACHE_BACKENDS = {
+    "memory": LRUCache,
+    "none": NullCache,
+}
+
+
+def make_cache(name: str, **options) -> CacheBackend:
+    """Build a cache with the backend chosen by CACHE_BACKEND."""
+    try:
+        backend = CACHE_BACKENDS[CACHE_BACKEND]
+    except KeyError as e:
+        raise ValueError(f"Unknown cache backend: {CACHE_BACKEND}") from e
+    if backend is NullCache:
+        return backend(name)
+    return backend(name, **options)
+
+
+note_cache = make_cache("notes")
+user_cache = make_cache("users")
+
+
+def get_cache_stats() -> list:
+    """Return the counters of every model cache."""
+    return [note_cache.stats(), user_cache.stats()]
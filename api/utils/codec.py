@@ -0,0 +1,116 @@
+"""codec.py"""
+
+import zlib
+from typing import Optional
+from api.settings import (
+    NOTE_CODEC, NOTE_CODEC_MIN_SIZE, NOTE_PREVIEW_SIZE, NOTE_ZLIB_LEVEL, NOTE_ZSTD_LEVEL
+)
+
+try:
+    import zstandard
+except ImportError:  # optional, "zstd" falls back to "zlib" without it
+    zstandard = None
+
+
+class ZlibCodec:
+    """zlib from the stdlib, always available."""
+    name = "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, NOTE_ZLIB_LEVEL)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCodec:
+    """Zstandard, when the `zstandard` package is installed."""
+    name = "zstd"
+
+    def compress(self, data: bytes) -> bytes:
+        # the (de)compressor objects are not thread-safe, one per call
+        return zstandard.ZstdCompressor(level=NOTE_ZSTD_LEVEL).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {"zlib": ZlibCodec}
+if zstandard is not None:
+    CODECS["zstd"] = ZstdCodec
+
+
+def make_codec(name: str):
+    """Build the codec chosen by NOTE_CODEC, None to store plain text."""
+    if name in ("", "none"):
+        return None
+    if name == "zstd" and zstandard is None:
+        print("zstandard is not installed, compressing notes with zlib")
+        name = "zlib"
+    try:
+        return CODECS[name]()
+    except KeyError as e:
+        raise ValueError(f"Unknown note codec: {name}") from e
+
+
+note_codec = make_codec(NOTE_CODEC)
+# Codecs of the stored notes, read whatever NOTE_CODEC was when written
+_decoders: dict = {}
+
+
+def pack_content(
+    content: str, codec=note_codec,
+    min_size: int = NOTE_CODEC_MIN_SIZE, preview_size: int = NOTE_PREVIEW_SIZE
+) -> dict:
+    """Stored form of a note content, as the values of its three columns.
+
+    Content of `min_size` bytes or more is compressed into `content_data`,
+    `content` then only keeps its first `preview_size` characters for
+    previews and search. Content that does not shrink stays plain.
+    """
+    if codec is not None:
+        raw = content.encode()
+        if len(raw) >= min_size:
+            data = codec.compress(raw)
+            preview = content[:preview_size]
+            if len(data) + len(preview.encode()) < len(raw):
+                return {"content": preview, "content_codec": codec.name, "content_data": data}
+    return {"content": content, "content_codec": None, "content_data": None}
+
+
+def unpack_content(content: str, codec_name: Optional[str], data: Optional[bytes]) -> str:
+    """Full text of a stored note content."""
+    if codec_name is None:
+        return content
+    codec = _decoders.get(codec_name)
+    if codec is None:
+        if codec_name not in CODECS:
+            raise ValueError(f"Note stored with unavailable codec: {codec_name}")
+        codec = _decoders[codec_name] = CODECS[codec_name]()
+    return codec.decompress(data).decode()
+
+
+def unpack_note(note: dict) -> dict:
+    """Replace the stored content columns of a note row by its full text."""
+    codec_name = note.pop("content_codec", None)
+    data = note.pop("content_data", None)
+    if codec_name is not None:
+        note["content"] = unpack_content(note["content"], codec_name, data)
+    return note
+
+
+def unpack_rows(rows, index: int) -> list:
+    """Rows ending with the codec and data columns, with the full text at
+    `index` and without those two columns."""
+    unpacked = []
+    for row in rows:
+        row = tuple(row)
+        codec_name, data = row[-2:]
+        row = row[:-2]
+        if codec_name is not None:
+            row = (
+                row[:index] + (unpack_content(row[index], codec_name, data),)
+                + row[index + 1:]
+            )
+        unpacked.append(row)
+    return unpacked
@@ -0,0 +1,220 @@
+"""compression.py"""
+
+import re
+import zlib
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from api.settings import (
+    COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, COMPRESSION_THREAD_MIN_SIZE,
+    GZIP_LEVEL, BROTLI_QUALITY, ZSTD_LEVEL
+)
+
+try:
+    import brotli
+except ImportError:  # optional, "br" is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, "zstd" is not offered without it
+    zstandard = None
+
+# Media types that are compressed already, or not worth compressing
+SKIPPED_TYPES = (
+    "image/", "video/", "audio/", "font/woff",
+    "application/zip", "application/gzip", "application/zstd",
+    "application/x-brotli", "application/octet-stream", "text/event-stream",
+)
+
+_ETAG_SUFFIX = re.compile(r'-(?:gzip|br|zstd)"')
+
+
+class GzipEncoder:
+    """gzip with the stdlib zlib, which releases the GIL."""
+    name = "gzip"
+
+    def __init__(self):
+        self._stream = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._stream.compress(chunk) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._stream.flush()
+
+
+class BrotliEncoder:
+    """Brotli, when the `brotli` package is installed."""
+    name = "br"
+
+    def __init__(self):
+        self._stream = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._stream.process(chunk) + self._stream.flush()
+
+    def finish(self) -> bytes:
+        return self._stream.finish()
+
+
+class ZstdEncoder:
+    """Zstandard, when the `zstandard` package is installed."""
+    name = "zstd"
+
+    def __init__(self):
+        self._stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._stream.compress(chunk) + self._stream.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._stream.flush()
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+
+# Server preference among the encodings the client accepts
+PREFERRED = [name for name in COMPRESSION_ENCODINGS if name in ENCODERS]
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Pick the preferred encoding allowed by an `Accept-Encoding` header."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for name in PREFERRED:
+        quality = accepted.get(name, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def _compress_body(encoding: str, body: bytes) -> bytes:
+    """Compress a whole body."""
+    encoder = ENCODERS[encoding]()
+    return encoder.compress(body) + encoder.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses per `Accept-Encoding`.
+
+    Bodies under COMPRESSION_MIN_SIZE, already encoded bodies and
+    compressed media types are sent as they are. Streaming responses are
+    compressed chunk by chunk, each chunk flushed so clients get rows
+    as they come. A compressed response gets its strong ETag suffixed
+    with the encoding, the suffix is removed from the conditional
+    headers of the requests and put back on the ETag of a 304 answering
+    an `If-None-Match` that carried it.
+    """
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # the client validates the compressed representation it holds
+        suffix = f'-{encoding}"'
+        suffixed = suffix in request_headers.get("if-none-match", "")
+        for name in ("if-none-match", "if-match"):
+            if name in request_headers:
+                headers = MutableHeaders(scope=scope)
+                headers[name] = _ETAG_SUFFIX.sub('"', request_headers[name])
+
+        start_message = None
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=start["headers"])
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+
+                etag = headers.get("etag")
+                if start["status"] == 304 and suffixed and etag:
+                    headers.add_vary_header("Accept-Encoding")
+                    if etag.endswith('"') and not etag.startswith("W/"):
+                        headers["ETag"] = etag[:-1] + suffix
+
+                if (
+                    start["status"] in (204, 304)
+                    or "content-encoding" in headers
+                    or headers.get("content-type", "").startswith(SKIPPED_TYPES)
+                ):
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body and len(body) < self.min_size:
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers["Content-Encoding"] = encoding
+                if etag and etag.endswith('"') and not etag.startswith("W/"):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+
+                if not more_body:
+                    if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+                        body = await run_in_threadpool(_compress_body, encoding, body)
+                    else:
+                        body = _compress_body(encoding, body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                del headers["Content-Length"]
+                encoder = ENCODERS[encoding]()
+                await send(start)
+
+            if encoder is None:
+                await send(message)
+                return
+
+            chunk = encoder.compress(message.get("body", b""))
+            if message.get("more_body", False):
+                if chunk:
+                    await send({
+                        "type": "http.response.body", "body": chunk, "more_body": True
+                    })
+            else:
+                await send({"type": "http.response.body", "body": chunk + encoder.finish()})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,72 @@
+"""etag.py"""
+
+from datetime import datetime
+from hashlib import blake2b
+from typing import Optional
+from fastapi import Request, Response
+
+
+class PreconditionFailedError(ValueError):
+    """Raised when the `If-Match` version of a write is not the current one"""
+
+
+def note_etag(note_id: int, time_edition: datetime) -> str:
+    """Strong ETag of one note, its id and edition time."""
+    return f'"note-{note_id}-{time_edition.isoformat()}"'
+
+
+def parse_note_etag(etag: str, note_id: int) -> datetime:
+    """Return the edition time of a note ETag made by `note_etag`."""
+    prefix = f'"note-{note_id}-'
+    if not (etag.startswith(prefix) and etag.endswith('"')):
+        raise PreconditionFailedError(f"ETag {etag} is not a version of note {note_id}")
+    try:
+        return datetime.fromisoformat(etag[len(prefix):-1])
+    except ValueError as e:
+        raise PreconditionFailedError(f"Invalid ETag: {etag}") from e
+
+
+def user_etag(user_id: int, version: int) -> str:
+    """Strong ETag of one user profile."""
+    return f'"user-{user_id}-v{version}"'
+
+
+def owner_notes_etag(request: Request, user_id: int, version: int) -> str:
+    """Strong ETag of one listing of the notes of a user.
+
+    The user version changes on every write to their notes, the query
+    string tells the pages of the listing apart.
+    """
+    query = blake2b(str(request.query_params).encode(), digest_size=8).hexdigest()
+    return f'"notes-{user_id}-v{version}-{query}"'
+
+
+def _etags(header: str) -> list:
+    """Split an If-Match/If-None-Match header into its ETags."""
+    return [etag.strip() for etag in header.split(",") if etag.strip()]
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """Whether the client already holds `etag` (weak comparison)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return any(
+        tag == "*" or tag.removeprefix("W/") == etag for tag in _etags(header)
+    )
+
+
+def if_match(request: Request) -> Optional[str]:
+    """The single strong ETag of the `If-Match` header, None without one."""
+    header = request.headers.get("if-match")
+    if not header:
+        return None
+    etags = _etags(header)
+    if len(etags) != 1 or etags[0] == "*" or etags[0].startswith("W/"):
+        raise PreconditionFailedError(f"Unsupported If-Match: {header}")
+    return etags[0]
+
+
+def not_modified(etag: str) -> Response:
+    """Empty `304 Not Modified` response."""
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,63 @@
+"""export.py"""
+
+import csv
+import json
+from datetime import datetime
+from io import StringIO
+
+EXPORT_COLUMNS = ("id", "user_id", "title", "content", "time_created", "time_edition")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _value(value):
+    """Format a column value like the JSON responses do."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def to_ndjson(rows) -> bytes:
+    """Encode rows as newline delimited JSON, one object per line."""
+    return "".join(
+        json.dumps(
+            {column: _value(value) for column, value in zip(EXPORT_COLUMNS, row)},
+            ensure_ascii=False, separators=(",", ":")
+        ) + "\n"
+        for row in rows
+    ).encode()
+
+
+def to_csv(rows, header: bool = False) -> bytes:
+    """Encode rows as CSV, with the column names first when `header`."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+def encode_chunks(chunks, fmt: str):
+    """Encode row chunks in the export format."""
+    if fmt == "csv":
+        yield to_csv([], header=True)
+        for rows in chunks:
+            yield to_csv(rows)
+    else:
+        for rows in chunks:
+            yield to_ndjson(rows)
+
+
+async def aencode_chunks(chunks, fmt: str):
+    """Async version of `encode_chunks`."""
+    if fmt == "csv":
+        yield to_csv([], header=True)
+        async for rows in chunks:
+            yield to_csv(rows)
+    else:
+        async for rows in chunks:
+            yield to_ndjson(rows)
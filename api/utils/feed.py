@@ -0,0 +1,206 @@
+"""feed.py"""
+
+import asyncio
+import os
+from collections import deque
+from datetime import datetime
+from secrets import token_hex
+from threading import Lock
+from typing import Optional
+from api.settings import FEED_REPLAY_SIZE, FEED_QUEUE_SIZE, FEED_HEARTBEAT
+from api.utils.responses import json_backend
+
+# Ends a subscription, pushed instead of an event
+_CLOSED = None
+
+
+class Subscription:
+    """Queue of the events of one owner for one client.
+
+    The queue is drained on the loop of the subscriber. When it holds
+    `max_queued` events the consumer is too slow: the subscription is
+    marked `overflowed` and closed, the client resumes from its last
+    event id through the replay buffer.
+    """
+    def __init__(self, user_id: int, max_queued: int = FEED_QUEUE_SIZE):
+        self.user_id = user_id
+        self.max_queued = max_queued
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, event: Optional[dict]):
+        """Queue one event, on the loop of the subscriber."""
+        if self.closed:
+            return
+        if event is _CLOSED:
+            self.closed = True
+        elif self.queue.qsize() >= self.max_queued:
+            self.overflowed = self.closed = True
+            event = _CLOSED
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """Wait for the next event, raises TimeoutError after `timeout`."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ChangeBroker:
+    """In-process broker of the note changes.
+
+    Writers `publish` from any thread once their transaction committed.
+    Every event gets the next sequence number of this process, and the
+    last `replay_size` events are kept so a client reconnecting with its
+    last event id gets what it missed. Event ids carry the `epoch` of the
+    broker, an id of an earlier process cannot be resumed.
+    """
+    def __init__(self, replay_size: int = FEED_REPLAY_SIZE):
+        self._replay: deque = deque(maxlen=replay_size)
+        self.reset()
+
+    def reset(self):
+        """Start a new epoch with no events nor subscribers, in a forked
+        child so its event ids never collide with its siblings'."""
+        self.epoch = token_hex(4)
+        self._lock = Lock()
+        self._seq = 0
+        self._replay.clear()
+        self._subscriptions: set = set()
+        self.published = 0
+        self.replayed = 0
+        self.resets = 0
+        self.overflows = 0
+
+    def event_id(self, event: dict) -> str:
+        """Id of an event, as sent to the clients."""
+        return f"{self.epoch}-{event['seq']}"
+
+    def publish(
+        self, kind: str, note_id: int, user_id: Optional[int],
+        time_edition: Optional[datetime] = None
+    ):
+        """Send a change of a note to the subscribers of its owner."""
+        if user_id is None:
+            return
+        with self._lock:
+            self._seq += 1
+            event = {
+                "seq": self._seq,
+                "type": kind,
+                "id": note_id,
+                "user_id": user_id,
+                "time_edition": time_edition,
+            }
+            self._replay.append(event)
+            self.published += 1
+            for subscription in self._subscriptions:
+                if subscription.user_id == user_id:
+                    self._deliver(subscription, event)
+
+    @staticmethod
+    def _deliver(subscription: Subscription, event: Optional[dict]):
+        """Hand an event to the loop of a subscription, from any thread."""
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.push, event)
+        except RuntimeError:  # its loop is closed, unsubscribe will follow
+            pass
+
+    def subscribe(self, user_id: int, last_event_id: Optional[str] = None):
+        """Open a subscription to the changes of one owner.
+
+        Returns the subscription and the events to send first: the
+        missed ones after `last_event_id`, or None when they cannot be
+        replayed and the client must reload its notes.
+        """
+        subscription = Subscription(user_id)
+        with self._lock:
+            backlog = []
+            if last_event_id:
+                backlog = self._missed(user_id, last_event_id)
+            self._subscriptions.add(subscription)
+        return subscription, backlog
+
+    def _missed(self, user_id: int, last_event_id: str) -> Optional[list]:
+        """Events of an owner after `last_event_id`, None when out of reach."""
+        epoch, _, seq = last_event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            self.resets += 1
+            return None
+        seq = int(seq)
+        oldest = self._replay[0]["seq"] if self._replay else self._seq + 1
+        if seq < oldest - 1 or seq > self._seq:
+            self.resets += 1
+            return None
+        missed = [
+            event for event in self._replay
+            if event["seq"] > seq and event["user_id"] == user_id
+        ]
+        self.replayed += len(missed)
+        return missed
+
+    def unsubscribe(self, subscription: Subscription):
+        """Close a subscription."""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            if subscription.overflowed:
+                self.overflows += 1
+
+    def close(self):
+        """End every subscription, on shutdown."""
+        with self._lock:
+            for subscription in self._subscriptions:
+                self._deliver(subscription, _CLOSED)
+
+    def stats(self) -> dict:
+        """Return the broker counters."""
+        with self._lock:
+            return {
+                "epoch": self.epoch,
+                "seq": self._seq,
+                "subscribers": len(self._subscriptions),
+                "replay_size": self._replay.maxlen,
+                "replay_buffered": len(self._replay),
+                "published": self.published,
+                "replayed": self.replayed,
+                "resets": self.resets,
+                "overflows": self.overflows,
+            }
+
+
+change_feed = ChangeBroker()
+os.register_at_fork(after_in_child=change_feed.reset)
+
+
+def _sse(event_type: str, data: dict, event_id: Optional[str] = None) -> bytes:
+    """Format one Server-Sent Event."""
+    head = f"id: {event_id}\n" if event_id else ""
+    head += f"event: {event_type}\ndata: "
+    return head.encode() + json_backend.dumps(data) + b"\n\n"
+
+
+async def stream_changes(
+    user_id: int, last_event_id: Optional[str] = None,
+    heartbeat: float = FEED_HEARTBEAT
+):
+    """Server-Sent Events of the changes of the notes of one owner."""
+    subscription, backlog = change_feed.subscribe(user_id, last_event_id)
+    try:
+        if backlog is None:
+            yield _sse("reset", {"reason": "events since last_event_id are gone"})
+            backlog = []
+        for event in backlog:
+            yield _sse(event["type"], event, change_feed.event_id(event))
+        while True:
+            try:
+                event = await subscription.next(heartbeat)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is _CLOSED:
+                if subscription.overflowed:
+                    yield _sse("overflow", {"reason": "consumer too slow, resume"})
+                return
+            yield _sse(event["type"], event, change_feed.event_id(event))
+    finally:
+        change_feed.unsubscribe(subscription)
@@ -0,0 +1,195 @@
+"""metrics.py"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the latency histograms
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# Upper bounds of the statements per request histogram
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """SQL counters of the request being served."""
+    __slots__ = ("statements", "db_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Remember when the statement started."""
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Add the statement to the current request counters."""
+    elapsed = perf_counter() - conn.info["query_start"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+class Histogram:
+    """Cumulative Prometheus histogram of one label set."""
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add one observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Request counters and histograms, rendered in Prometheus text format."""
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = {}
+        self.latency = {}
+        self.db_time = {}
+        self.statements = {}
+        self.counters = []
+
+    def register_counter(self, name: str, help_text: str, read):
+        """Add a counter kept elsewhere, `read()` returns its value."""
+        with self._lock:
+            self.counters.append((name, help_text, read))
+
+    def record(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        """Add one served request."""
+        key = (method, route)
+        with self._lock:
+            counter = (method, route, str(status))
+            self.requests[counter] = self.requests.get(counter, 0) + 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.db_time[key] = Histogram(LATENCY_BUCKETS)
+                self.statements[key] = Histogram(STATEMENT_BUCKETS)
+            self.latency[key].observe(elapsed)
+            self.db_time[key].observe(stats.db_time)
+            self.statements[key].observe(stats.statements)
+
+    @staticmethod
+    def _labels(names: tuple, values: tuple) -> str:
+        """Format a Prometheus label set."""
+        return ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in zip(names, values)
+        )
+
+    def _histogram(self, lines: list, name: str, help_text: str, series: dict):
+        """Append one histogram family."""
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(series.items()):
+            labels = self._labels(("method", "route"), key)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP http_requests_total Requests served.",
+                "# TYPE http_requests_total counter",
+            ]
+            for key, count in sorted(self.requests.items()):
+                labels = self._labels(("method", "route", "status"), key)
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+
+            self._histogram(
+                lines, "http_request_duration_seconds",
+                "Time to serve a request.", self.latency
+            )
+            self._histogram(
+                lines, "db_time_seconds",
+                "Time spent in SQL statements per request.", self.db_time
+            )
+            self._histogram(
+                lines, "db_statements_per_request",
+                "SQL statements executed per request.", self.statements
+            )
+            for name, help_text, read in self.counters:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every request and counting its SQL.
+
+    Adds a `Server-Timing` header (`app`, `db`) to the response and
+    aggregates the numbers per route template in `metrics`.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = (perf_counter() - start) * 1000
+                timing = (
+                    f"app;dur={elapsed:.2f}, "
+                    f'db;dur={stats.db_time * 1000:.2f};desc="{stats.statements} queries"'
+                )
+                message.setdefault("headers", [])
+                message["headers"] = [
+                    *message["headers"], (b"server-timing", timing.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get("route")
+            metrics.record(
+                scope["method"],
+                getattr(route, "path", "<unmatched>"),
+                status,
+                perf_counter() - start,
+                stats,
+            )
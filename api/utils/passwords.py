@@ -0,0 +1,178 @@
+"""passwords.py"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+from api.settings import (
+    PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P,
+    PASSWORD_WORKERS, PASSWORD_QUEUE_MAX
+)
+
+SCHEME = "scrypt"
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+
+class PasswordQueueFullError(RuntimeError):
+    """Raised when too many hashes are already waiting for a worker"""
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """Derive the key of `password`, hashlib releases the GIL meanwhile."""
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=2 * 128 * n * r * p + 1024 * 1024, dklen=HASH_SIZE
+    )
+
+
+def hash_password(
+    password: str,
+    n: int = PASSWORD_SCRYPT_N, r: int = PASSWORD_SCRYPT_R, p: int = PASSWORD_SCRYPT_P
+) -> str:
+    """Hash a password as `scrypt$n$r$p$salt$hash`, blocking."""
+    salt = os.urandom(SALT_SIZE)
+    key = _scrypt(password, salt, n, r, p)
+    return "$".join((
+        SCHEME, str(n), str(r), str(p),
+        b64encode(salt).decode(), b64encode(key).decode()
+    ))
+
+
+def verify_password(password: str, stored: str) -> tuple:
+    """Check a password against its stored hash, blocking.
+
+    Returns `(matches, needs_rehash)`. Stored values that are not scrypt
+    hashes are the plaintext passwords of accounts created before hashing,
+    they match by value and always need a rehash, as do hashes made with
+    other cost parameters than the current ones.
+    """
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+
+    n, r, p = (int(value) for value in parts[1:4])
+    key = _scrypt(password, b64decode(parts[4]), n, r, p)
+    matches = hmac.compare_digest(key, b64decode(parts[5]))
+    current = (n, r, p) == (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return matches, not current
+
+
+class PasswordHasher:
+    """Runs the password KDF in a bounded thread pool.
+
+    At most `workers` hashes run at once, the others queue. Past
+    `queue_max` queued hashes, new ones are refused with
+    PasswordQueueFullError instead of growing the login latency.
+    """
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_max: int = PASSWORD_QUEUE_MAX):
+        self.workers = workers
+        self.queue_max = queue_max
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.queued = 0
+        self.active = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Create the pool on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password"
+                )
+            return self._executor
+
+    def _run(self, submitted_at: float, func, *args):
+        """Worker side of `submit`, records the wait and run times."""
+        start = perf_counter()
+        wait = start - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.total_run += perf_counter() - start
+
+    async def submit(self, func, *args):
+        """Run `func(*args)` in the pool without blocking the event loop."""
+        executor = self._get_executor()
+        with self._lock:
+            if self.queued >= self.queue_max:
+                self.rejected += 1
+                raise PasswordQueueFullError(
+                    f"Too many password hashes queued: {self.queued}"
+                )
+            self.submitted += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, self._run, perf_counter(), func, *args
+        )
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the current cost parameters."""
+        return await self.submit(hash_password, password)
+
+    async def verify(self, password: str, stored: str) -> tuple:
+        """Check a password, see `verify_password`."""
+        return await self.submit(verify_password, password, stored)
+
+    def shutdown(self):
+        """Wait for the running hashes and stop the workers."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def reset(self):
+        """Forget the pool and the hashes in flight inherited through a fork."""
+        self._lock = Lock()
+        self._executor = None
+        self.queued = 0
+        self.active = 0
+
+    def stats(self) -> dict:
+        """Return the pool usage counters."""
+        with self._lock:
+            started = self.submitted - self.queued
+            return {
+                "workers": self.workers,
+                "queue_max": self.queue_max,
+                "scrypt": {
+                    "n": PASSWORD_SCRYPT_N, "r": PASSWORD_SCRYPT_R, "p": PASSWORD_SCRYPT_P
+                },
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "wait_time_avg_ms": round(
+                    self.total_wait * 1000 / started, 3
+                ) if started else 0.0,
+                "wait_time_max_ms": round(self.max_wait * 1000, 3),
+                "run_time_avg_ms": round(
+                    self.total_run * 1000 / (started - self.active), 3
+                ) if started > self.active else 0.0,
+            }
+
+
+password_hasher = PasswordHasher()
+# the threads of the pool do not survive a fork, the child makes its own
+os.register_at_fork(after_in_child=password_hasher.reset)
@@ -0,0 +1,27 @@
+"""patch.py"""
+
+
+class InvalidPatchError(ValueError):
+    """Raised for edits that do not fit the text they are applied to"""
+
+
+def apply_edits(text: str, edits: list) -> str:
+    """Apply edits made against `text` and return the new text.
+
+    Each edit replaces `text[start:end]` with its `text`. Offsets count
+    code points of the base text, edits must be sorted and must not
+    overlap, so a client only sends the regions it changed.
+    """
+    parts = []
+    position = 0
+    for edit in edits:
+        if edit.start < position or edit.end < edit.start or edit.end > len(text):
+            raise InvalidPatchError(
+                f"Edit [{edit.start}:{edit.end}] overlaps a previous one or "
+                f"is out of the base text (length {len(text)})"
+            )
+        parts.append(text[position:edit.start])
+        parts.append(edit.text)
+        position = edit.end
+    parts.append(text[position:])
+    return "".join(parts)
@@ -0,0 +1,119 @@
+"""responses.py"""
+
+import json
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from api.settings import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+
+def _default(value: Any):
+    """Encode the non-JSON column types like FastAPI's `jsonable_encoder`."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class StdlibJSON:
+    """Stdlib `json`, with the separators of FastAPI's JSONResponse."""
+    name = "json"
+
+    def dumps(self, content: Any) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+            default=_default,
+        ).encode("utf-8")
+
+
+class OrJSON(StdlibJSON):
+    """orjson, datetimes are encoded natively in the same ISO format.
+
+    Content orjson refuses (integers over 64 bits, NaN) goes through the
+    stdlib encoder so the output never changes.
+    """
+    name = "orjson"
+
+    def dumps(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().dumps(content)
+
+
+JSON_BACKENDS = {
+    "orjson": OrJSON,
+    "json": StdlibJSON,
+}
+
+
+def make_json_backend(name: str) -> StdlibJSON:
+    """Build the encoder chosen by JSON_BACKEND."""
+    try:
+        backend = JSON_BACKENDS[name]
+    except KeyError as e:
+        raise ValueError(f"Unknown JSON backend: {name}") from e
+    if backend is OrJSON and orjson is None:
+        print("orjson is not installed, using the stdlib json encoder")
+        backend = StdlibJSON
+    return backend()
+
+
+json_backend = make_json_backend(JSON_BACKEND)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by `json_backend`, the default of the app.
+
+    The bytes match FastAPI's JSONResponse for the note and user routes.
+    """
+    def render(self, content: Any) -> bytes:
+        return json_backend.dumps(content)
+
+
+class RowsResponse(FastJSONResponse):
+    """JSON response of plain rows (dicts), rendered without Pydantic.
+
+    Returned by the read-only list and search routes: the rows already hold
+    only the columns of the response model, so per-row validation is
+    skipped. The bytes match what FastAPI renders through the model.
+    """
+
+
+class ShapeEncoder:
+    """Pre-built encoder of one response model, for dicts and entities.
+
+    Keeps the fields of the model in its order and drops the others
+    (password), without validating the values.
+    """
+    __slots__ = ("fields",)
+
+    def __init__(self, model: type[BaseModel]):
+        self.fields = tuple(model.model_fields)
+
+    def project(self, row: Any) -> dict:
+        """Return the fields of the model of one row, a dict or an entity."""
+        if isinstance(row, dict):
+            return {field: row.get(field) for field in self.fields}
+        return {field: getattr(row, field, None) for field in self.fields}
+
+    def encode(self, content: Any) -> bytes:
+        """Encode one row or a list of rows."""
+        if isinstance(content, list):
+            return json_backend.dumps([self.project(row) for row in content])
+        return json_backend.dumps(self.project(content))
+
+    def response(self, content: Any, status_code: int = 200) -> Response:
+        """Return one row or a list of rows as a JSON response."""
+        return Response(
+            self.encode(content), status_code=status_code, media_type="application/json"
+        )
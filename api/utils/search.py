@@ -0,0 +1,82 @@
+"""search.py"""
+
+import re
+from typing import Optional
+from sqlalchemy import (
+    Column, Integer, MetaData, Table, Text, false, func, literal, literal_column
+)
+from sqlalchemy.dialects.mysql import match as mysql_match
+from sqlalchemy.orm import Query, Session
+from api.database import NoteDb, SEARCH_FIELDS
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Query side of the FTS5 table created by `create_search_index`, kept
+# out of Base.metadata so create_all never tries to create it
+notes_fts = Table(
+    "notes_fts", MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("title", Text),
+    Column("content", Text),
+)
+
+
+def tokenize(query: str) -> list:
+    """Split a search query into lower case words."""
+    return _TOKEN.findall(query.lower())
+
+
+def ranked_search(
+    sess: Session, field: str, query: str, user_id: Optional[int] = None
+) -> tuple:
+    """Return the notes matching `query` on `field` and their rank.
+
+    Every word is matched as a prefix, so partial words typed by the
+    clients still match. A lower rank is a better match. `user_id`
+    limits the search to the notes of one owner.
+    """
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"Invalid search field: {field}")
+
+    words = tokenize(query)
+    if not words:
+        return sess.query(NoteDb).filter(false()), literal(0)
+
+    dialect = sess.get_bind().dialect.name
+    notes = sess.query(NoteDb)
+
+    if user_id is not None:
+        notes = notes.filter(NoteDb.user_id == user_id)
+
+    if dialect == "sqlite":
+        terms = " AND ".join(f'"{word}"*' for word in words)
+        fts = literal_column("notes_fts")
+        notes = notes.join(
+            notes_fts, notes_fts.c.rowid == NoteDb.id
+        ).filter(
+            fts.op("MATCH")(f"{field} : ({terms})")
+        )
+        return notes, func.bm25(fts)
+
+    if dialect == "mysql":
+        score = mysql_match(
+            getattr(NoteDb, field),
+            against=" ".join(f"+{word}*" for word in words)
+        ).in_boolean_mode()
+        return notes.filter(score), -score
+
+    column = func.lower(getattr(NoteDb, field))
+    for word in words:
+        notes = notes.filter(column.like(f"%{word}%"))
+    return notes, literal(0)
+
+
+def search_query(
+    sess: Session, field: str, query: str, user_id: Optional[int] = None
+) -> Query:
+    """Return the notes matching `query` on `field`, best matches first.
+
+    Ties are ordered by id to keep pages stable.
+    """
+    notes, rank = ranked_search(sess, field, query, user_id)
+    return notes.order_by(rank, NoteDb.id)
@@ -1,6 +1,10 @@
 """session.py"""
 
+from typing import Optional
 from fastapi import Request
+from api.app import user_model
+from api.utils.session_store import session_store, call_store
+from api.utils.touch import user_touches
 
 
 class SessionManager:
@@ -11,11 +15,37 @@ class SessionManager:
 
     @classmethod
     async def get_session_id(cls, request: Request):
-        """Get session id from session object."""
-        return cls(
-            user_id=request.session.get("id"),
-            session_id=request.session.get("session_id")
+        """Resolve the session id of the cookie through the session store."""
+        session_id = request.session.get("session_id")
+        if not session_id:
+            return cls()
+        record = await call_store(session_store.get, session_id)
+        if record is None:
+            return cls()
+        user_touches.touch(record.user_id)
+        return cls(user_id=record.user_id, session_id=session_id)
+
+    @classmethod
+    async def login(cls, request: Request, user_id: int):
+        """Open a new session for `user_id`, replacing the current one."""
+        session_id = await call_store(
+            session_store.rotate, request.session.get("session_id"), user_id
         )
+        request.session.clear()
+        request.session["session_id"] = session_id
+        return cls(user_id=user_id, session_id=session_id)
+
+    async def get_user(self) -> Optional[dict]:
+        """Resolve the session user, from the user cache when possible."""
+        if self.user_id is None:
+            return None
+        return await user_model.get_user_by_id(self.user_id)
+
+    async def clear(self, request: Request):
+        """Forget the session, in the cookie and in the session store."""
+        if self.session_id:
+            await call_store(session_store.delete, self.session_id)
+        request.session.clear()
 
 
 async def get_session_manager(request: Request) -> SessionManager:
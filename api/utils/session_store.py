@@ -0,0 +1,335 @@
+"""session_store.py"""
+
+import asyncio
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from secrets import token_urlsafe
+from threading import Lock
+from time import time
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from api.settings import (
+    SESSION_STORE, SESSION_STORE_PATH, SESSION_IDLE_TIMEOUT,
+    SESSION_TOUCH_INTERVAL, SESSION_SWEEP_INTERVAL
+)
+
+
+def new_session_id() -> str:
+    """Return a new random session id."""
+    return token_urlsafe(32)
+
+
+class SessionRecord:
+    """Server-side state of one session."""
+    __slots__ = ("user_id", "created", "last_seen")
+
+    def __init__(self, user_id: int, created: float, last_seen: float):
+        self.user_id = user_id
+        self.created = created
+        self.last_seen = last_seen
+
+
+class SessionStore(ABC):
+    """Interface of the server-side session stores.
+
+    The cookie only carries the session id. A session expires once it has
+    not been seen for `idle_timeout` seconds. `blocking` stores do I/O and
+    are called from the threadpool by the async code.
+    """
+    blocking = False
+
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.rotated = 0
+        self.expired = 0
+
+    @abstractmethod
+    def create(self, user_id: int) -> str:
+        """Open a session for `user_id` and return its id."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[SessionRecord]:
+        """Return the live session and mark it as seen, None when unknown."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Close one session."""
+
+    @abstractmethod
+    def delete_user(self, user_id: int):
+        """Close every session of one user, `user_id` is compared as an int."""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Drop the idle sessions and return how many were dropped."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Return the number of open sessions."""
+
+    def rotate(self, session_id: Optional[str], user_id: int) -> str:
+        """Replace the session of a client with a new one, on login."""
+        if session_id:
+            self.delete(session_id)
+            self.rotated += 1
+        return self.create(user_id)
+
+    def close(self):
+        """Release the resources of the store."""
+
+    def reset(self):
+        """Drop the resources inherited through a fork, in the child."""
+
+    def stats(self) -> dict:
+        """Return the usage counters."""
+        return {
+            "backend": self.name,
+            "sessions": self.count(),
+            "idle_timeout": self.idle_timeout,
+            "created": self.created,
+            "rotated": self.rotated,
+            "expired": self.expired,
+        }
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions in a dict of this process, ordered by last seen time.
+
+    Lookups are O(1) and the sweeper only visits the expired sessions.
+    Every worker process has its own sessions.
+    """
+    name = "memory"
+
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        super().__init__(idle_timeout)
+        self._lock = Lock()
+        self._sessions: OrderedDict = OrderedDict()
+
+    def create(self, user_id):
+        session_id = new_session_id()
+        now = time()
+        with self._lock:
+            self._sessions[session_id] = SessionRecord(user_id, now, now)
+            self.created += 1
+        return session_id
+
+    def get(self, session_id):
+        now = time()
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            if now - record.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            record.last_seen = now
+            self._sessions.move_to_end(session_id)
+            return record
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def delete_user(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            for session_id in [
+                key for key, record in self._sessions.items()
+                if record.user_id == user_id
+            ]:
+                del self._sessions[session_id]
+
+    def sweep(self):
+        deadline = time() - self.idle_timeout
+        dropped = 0
+        with self._lock:
+            while self._sessions:
+                session_id, record = next(iter(self._sessions.items()))
+                if record.last_seen > deadline:
+                    break
+                del self._sessions[session_id]
+                dropped += 1
+            self.expired += dropped
+        return dropped
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file, shared by the worker processes.
+
+    `last_seen` is written at most once per SESSION_TOUCH_INTERVAL per
+    session, so a busy session does not cost a write per request.
+    """
+    name = "sqlite"
+    blocking = True
+
+    def __init__(
+        self, path: str = SESSION_STORE_PATH,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        touch_interval: float = SESSION_TOUCH_INTERVAL
+    ):
+        super().__init__(idle_timeout)
+        self.path = path
+        self.touch_interval = touch_interval
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database and create its table on first use."""
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=30
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_seen REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_last_seen ON sessions (last_seen)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def create(self, user_id):
+        session_id = new_session_id()
+        now = time()
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?)",
+                (session_id, user_id, now, now)
+            )
+            self.created += 1
+        return session_id
+
+    def get(self, session_id):
+        now = time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT user_id, created, last_seen FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            record = SessionRecord(*row)
+            if now - record.last_seen > self.idle_timeout:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self.expired += 1
+                return None
+            if now - record.last_seen > self.touch_interval:
+                conn.execute(
+                    "UPDATE sessions SET last_seen = ? WHERE session_id = ?",
+                    (now, session_id)
+                )
+                record.last_seen = now
+            return record
+
+    def delete(self, session_id):
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+
+    def delete_user(self, user_id):
+        with self._lock:
+            self._connection().execute(
+                "DELETE FROM sessions WHERE user_id = ?", (int(user_id),)
+            )
+
+    def sweep(self):
+        with self._lock:
+            dropped = self._connection().execute(
+                "DELETE FROM sessions WHERE last_seen < ?",
+                (time() - self.idle_timeout,)
+            ).rowcount
+            self.expired += dropped
+        return dropped
+
+    def count(self):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT count(*) FROM sessions"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def reset(self):
+        # a SQLite connection must not be used across a fork
+        self._lock = Lock()
+        self._conn = None
+
+
+SESSION_STORES = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+
+def make_session_store(name: str) -> SessionStore:
+    """Build the session store chosen by SESSION_STORE."""
+    try:
+        return SESSION_STORES[name]()
+    except KeyError as e:
+        raise ValueError(f"Unknown session store: {name}") from e
+
+
+session_store = make_session_store(SESSION_STORE)
+os.register_at_fork(after_in_child=session_store.reset)
+
+
+async def call_store(method, *args):
+    """Call a method of `session_store` without blocking the event loop."""
+    if session_store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+async def _sweep_forever(interval: float):
+    """Expire the idle sessions every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dropped = await call_store(session_store.sweep)
+            if dropped:
+                print(f"Expired {dropped} idle sessions")
+        except Exception as e:
+            print(f"Session sweep failed: {e}")
+
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def start_session_sweeper(interval: float = SESSION_SWEEP_INTERVAL):
+    """Start the background sweeper of the session store, once."""
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.get_running_loop().create_task(_sweep_forever(interval))
+
+
+async def stop_session_sweeper():
+    """Stop the sweeper and close the session store."""
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
+    await call_store(session_store.close)
@@ -0,0 +1,90 @@
+"""sync.py"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from api.settings import SYNC_TOMBSTONE_RETENTION, SYNC_COMPACT_INTERVAL
+from api.utils.pagination import InvalidCursorError, encode_cursor, decode_cursor
+
+
+class SyncExpiredError(ValueError):
+    """Raised for a sync cursor older than the tombstone retention"""
+
+
+def encode_sync_cursor(notes_key: Optional[list], deleted_key: list) -> str:
+    """Encode the positions reached in the notes and in the tombstones,
+    and when they were reached."""
+    return encode_cursor([
+        *(notes_key or [None, None]), *deleted_key, datetime.now().replace(microsecond=0)
+    ])
+
+
+def _is_key(values) -> bool:
+    """Whether `values` is an `(owner_version, id)` key of two ints."""
+    return all(
+        isinstance(value, int) and not isinstance(value, bool) for value in values
+    )
+
+
+def decode_sync_cursor(cursor: Optional[str]) -> tuple:
+    """Decode a sync cursor into the notes key (None from the start) and
+    the tombstones key, both `(owner_version, id)`.
+
+    Without a cursor the client has nothing yet: every note is sent and
+    only the deletions from now on matter, the tombstones key is None.
+    """
+    if not cursor:
+        return None, None
+    values = decode_cursor(cursor)
+    if len(values) == 4:
+        raise SyncExpiredError("Sync cursor of an earlier release, resync")
+    if (
+        len(values) != 5
+        or not isinstance(values[4], datetime) or values[4].tzinfo is not None
+        or not (values[:2] == [None, None] or _is_key(values[:2]))
+        or not _is_key(values[2:4])
+    ):
+        raise InvalidCursorError(f"Invalid sync cursor: {cursor}")
+    if values[4] < datetime.now() - timedelta(seconds=SYNC_TOMBSTONE_RETENTION):
+        raise SyncExpiredError("Sync cursor is past the tombstone retention, resync")
+    notes_key = values[:2] if values[0] is not None else None
+    return notes_key, values[2:4]
+
+
+async def _compact_forever(compact, interval: float):
+    """Call `compact()` every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dropped = await compact()
+            if dropped:
+                print(f"Compacted {dropped} note tombstones")
+        except Exception as e:
+            print(f"Tombstone compaction failed: {e}")
+
+
+_compactor: Optional[asyncio.Task] = None
+
+
+def start_tombstone_compactor(compact, interval: float = SYNC_COMPACT_INTERVAL):
+    """Start the background compaction of the tombstones, once.
+
+    `compact` is the coroutine function dropping the expired tombstones.
+    """
+    global _compactor
+    if _compactor is None or _compactor.done():
+        _compactor = asyncio.get_running_loop().create_task(
+            _compact_forever(compact, interval)
+        )
+
+
+async def stop_tombstone_compactor():
+    """Stop the compaction task."""
+    global _compactor
+    if _compactor is not None:
+        _compactor.cancel()
+        try:
+            await _compactor
+        except asyncio.CancelledError:
+            pass
+        _compactor = None
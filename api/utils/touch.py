@@ -0,0 +1,172 @@
+"""touch.py"""
+
+import asyncio
+import os
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+from sqlalchemy import Table, bindparam, or_, update
+from starlette.concurrency import run_in_threadpool
+from api.settings import DB_BACKEND, TOUCH_BUFFER_MAX, TOUCH_FLUSH_INTERVAL
+from api.database import UserDb, NoteDb, get_engine, get_async_engine
+
+
+class TouchBuffer:
+    """Write-behind buffer of one timestamp column.
+
+    `touch` only records the time in memory, touches of the same row are
+    coalesced to the latest one. `flush` writes them all with one
+    executemany UPDATE, which never moves a timestamp backwards (several
+    workers may flush the same row). Past `max_entries` rows new rows are
+    dropped and counted, touches are best effort.
+    """
+    def __init__(self, table: Table, column: str, max_entries: int = TOUCH_BUFFER_MAX):
+        self.table = table
+        self.column = column
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._pending: dict = {}
+        self.full = asyncio.Event()
+        self.touches = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.written = 0
+        column = table.c[column]
+        self._statement = update(table).where(
+            table.c.id == bindparam("row_id"),
+            or_(column.is_(None), column < bindparam("touched_at"))
+        ).values({column: bindparam("touched_at")})
+
+    def touch(self, row_id: int, when: Optional[datetime] = None):
+        """Record that a row was used now, without any I/O."""
+        when = when or datetime.now()
+        with self._lock:
+            self.touches += 1
+            if row_id not in self._pending and len(self._pending) >= self.max_entries:
+                self.dropped += 1
+                return
+            self._pending[row_id] = max(when, self._pending.get(row_id, when))
+            if len(self._pending) >= self.max_entries:
+                self.full.set()
+
+    def take(self) -> list:
+        """Empty the buffer and return its rows as UPDATE parameters."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.full.clear()
+        return [
+            {"row_id": row_id, "touched_at": when} for row_id, when in pending.items()
+        ]
+
+    def restore(self, rows: list):
+        """Put back the rows of a failed flush, unless newer touches replaced them."""
+        with self._lock:
+            for row in rows:
+                row_id, when = row["row_id"], row["touched_at"]
+                if row_id in self._pending:
+                    self._pending[row_id] = max(when, self._pending[row_id])
+                elif len(self._pending) < self.max_entries:
+                    self._pending[row_id] = when
+                else:
+                    self.dropped += 1
+
+    def reset(self):
+        """Drop the touches inherited through a fork, the parent writes them."""
+        self._lock = Lock()
+        self._pending = {}
+
+    def _write(self, rows: list):
+        """Write rows with the sync engine."""
+        with get_engine().begin() as connection:
+            connection.execute(self._statement, rows)
+
+    async def flush(self) -> int:
+        """Write the buffered touches, off the event loop."""
+        rows = self.take()
+        if not rows:
+            return 0
+        try:
+            if DB_BACKEND == "async":
+                async with get_async_engine().begin() as connection:
+                    await connection.execute(self._statement, rows)
+            else:
+                await run_in_threadpool(self._write, rows)
+        except Exception:
+            self.restore(rows)
+            raise
+        with self._lock:
+            self.flushes += 1
+            self.written += len(rows)
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Return the buffer counters."""
+        with self._lock:
+            return {
+                "column": f"{self.table.name}.{self.column}",
+                "pending": len(self._pending),
+                "max_entries": self.max_entries,
+                "touches": self.touches,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "written": self.written,
+            }
+
+
+user_touches = TouchBuffer(UserDb.__table__, "last_opened")
+note_touches = TouchBuffer(NoteDb.__table__, "last_read")
+TOUCH_BUFFERS = (user_touches, note_touches)
+for _buffer in TOUCH_BUFFERS:
+    os.register_at_fork(after_in_child=_buffer.reset)
+
+
+async def flush_touches():
+    """Flush every buffer, the rows of a failed flush wait for the next one."""
+    for buffer in TOUCH_BUFFERS:
+        try:
+            await buffer.flush()
+        except Exception as e:
+            print(f"Flush of {buffer.table.name}.{buffer.column} failed: {e}")
+
+
+async def _flush_forever(interval: float):
+    """Flush every `interval` seconds, or as soon as a buffer is full."""
+    while True:
+        waits = [asyncio.ensure_future(buffer.full.wait()) for buffer in TOUCH_BUFFERS]
+        try:
+            await asyncio.wait(waits, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for wait in waits:
+                wait.cancel()
+        await flush_touches()
+
+
+_flusher: Optional[asyncio.Task] = None
+
+
+def start_touch_flusher(interval: float = TOUCH_FLUSH_INTERVAL):
+    """Start the background flusher of the touch buffers, once."""
+    global _flusher
+    if _flusher is None or _flusher.done():
+        for buffer in TOUCH_BUFFERS:
+            # events belong to the loop that first waits on them
+            buffer.full = asyncio.Event()
+        _flusher = asyncio.get_running_loop().create_task(_flush_forever(interval))
+
+
+async def stop_touch_flusher():
+    """Stop the flusher and write what is still buffered."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await flush_touches()
+
+
+def get_touch_stats() -> list:
+    """Return the counters of every touch buffer."""
+    return [buffer.stats() for buffer in TOUCH_BUFFERS]
@@ -0,0 +1,344 @@
+"""load.py
+
+Endpoint load benchmark, runs the real app against a local SQLite database.
+
+    python -m benchmarks.load --concurrency 50 --duration 15 --output run.json
+    python -m benchmarks.load --baseline run.json --max-regression 0.2
+
+The database is seeded with synthetic users and notes, then the app is
+started with `serve.py` and every virtual user registers, logs in and loops over the
+note and user routes. Throughput and p50/p95/p99 latency are reported per
+endpoint and saved as JSON so runs can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima "
+    "mike november oscar papa quebec romeo sierra tango uniform victor whiskey"
+).split()
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    """Random text built from WORDS."""
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(database_url: str, users: int, notes: int, seed_value: int):
+    """Create the schema and fill it with synthetic users and notes."""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT)
+    # imported late, the settings are read from the environment at import
+    from sqlalchemy import insert
+    from api.database import UserDb, NoteDb, get_engine, dispose_engine
+    from api.migrations import upgrade
+    from api.utils.passwords import hash_password
+
+    rng = random.Random(seed_value)
+    upgrade()
+    now = datetime.now()
+    # one hash for every seeded user, hashing each would dominate seeding
+    password = hash_password("seed-password")
+
+    with get_engine().begin() as connection:
+        connection.execute(insert(UserDb), [
+            {
+                "username": f"seed_user_{i}",
+                "email": f"seed_user_{i}@example.com",
+                "hashed_password": password,
+            }
+            for i in range(users)
+        ])
+        for start in range(0, notes, 5000):
+            connection.execute(insert(NoteDb), [
+                {
+                    "user_id": rng.randint(1, users),
+                    "title": sentence(rng, 3),
+                    "content": sentence(rng, rng.randint(20, 200)),
+                    "time_created": now,
+                    "time_edition": now,
+                }
+                for _ in range(start, min(notes, start + 5000))
+            ])
+
+    dispose_engine()
+
+
+def free_port() -> int:
+    """Ask the OS for a free TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url: str, port: int, workers: int, env: dict) -> subprocess.Popen:
+    """Start the app with the production launcher (`serve.py`) on the seeded
+    database and wait until it answers."""
+    server_env = {**os.environ, **env, "DATABASE_URL": database_url}
+    process = subprocess.Popen(
+        [
+            sys.executable, "serve.py",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=ROOT, env=server_env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("the server exited during startup")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("the server did not start in 30 seconds")
+
+
+class Recorder:
+    """Collects latencies and errors per endpoint."""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def call(self, name: str, client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        """Time one request under `name`."""
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        """Throughput and latency percentiles (ms) per endpoint."""
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+        total = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_errors": sum(self.errors.values()),
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+async def virtual_user(
+    number: int, base_url: str, recorder: Recorder, stop_at: float,
+    note_count: int, rng: random.Random
+):
+    """Register, log in, then loop over the note and user routes."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        username = f"bench_{number}_{rng.randrange(10 ** 9)}"
+        await recorder.call(
+            "POST /api/users/register", client, "POST", "/api/users/register",
+            params={
+                "username": username, "email": f"{username}@example.com",
+                "password": "bench-password",
+            }
+        )
+        await recorder.call(
+            "POST /api/users/login", client, "POST", "/api/users/login",
+            params={"username": username, "password": "bench-password"}
+        )
+
+        own_notes = []
+        while time.monotonic() < stop_at:
+            await recorder.call("GET /api/users/me", client, "GET", "/api/users/me")
+            await recorder.call(
+                "GET /api/notes/list", client, "GET", "/api/notes/list",
+                params={"skip": rng.randrange(max(1, note_count)), "limit": 20}
+            )
+            await recorder.call(
+                "GET /api/notes/id", client, "GET", "/api/notes/id",
+                params={"note_id": rng.randint(1, max(1, note_count))}
+            )
+            await recorder.call(
+                "GET /api/notes/title", client, "GET", "/api/notes/title",
+                params={"query": rng.choice(WORDS), "limit": 20}
+            )
+            await recorder.call(
+                "GET /api/notes/content", client, "GET", "/api/notes/content",
+                params={"query": rng.choice(WORDS)[:3], "limit": 20}
+            )
+
+            response = await recorder.call(
+                "POST /api/notes/create", client, "POST", "/api/notes/create",
+                json={"title": sentence(rng, 3), "content": sentence(rng, 50)}
+            )
+            if response is not None and response.status_code == 200:
+                own_notes.append(response.json()["id"])
+
+            if own_notes:
+                await recorder.call(
+                    "PUT /api/notes/{note_id}/update", client, "PUT",
+                    f"/api/notes/{rng.choice(own_notes)}/update",
+                    params={"content": sentence(rng, 60)}
+                )
+            if len(own_notes) > 5:
+                await recorder.call(
+                    "DELETE /api/notes/{note_id}/delete", client, "DELETE",
+                    f"/api/notes/{own_notes.pop(0)}/delete"
+                )
+
+
+async def drive(base_url: str, concurrency: int, duration: float, note_count: int, seed_value: int) -> dict:
+    """Run `concurrency` virtual users for `duration` seconds."""
+    recorder = Recorder()
+    start = time.monotonic()
+    stop_at = start + duration
+    await asyncio.gather(*[
+        virtual_user(
+            number, base_url, recorder, stop_at, note_count,
+            random.Random(seed_value + number)
+        )
+        for number in range(concurrency)
+    ])
+    return recorder.report(time.monotonic() - start)
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list:
+    """Return the endpoints whose p95 got slower than `max_regression`."""
+    regressions = []
+    for name, stats in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        print(f"{name:38} p95 {before['p95_ms']:9.2f} -> {stats['p95_ms']:9.2f} ms ({change:+.1%})")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def print_report(results: dict):
+    """Print the per endpoint table."""
+    print(f"{'endpoint':38} {'reqs':>7} {'err':>5} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in results["endpoints"].items():
+        print(
+            f"{name:38} {stats['requests']:7} {stats['errors']:5} "
+            f"{stats['throughput_rps']:9.1f} {stats['p50_ms']:9.2f} "
+            f"{stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f}"
+        )
+    print(
+        f"total: {results['total_requests']} requests, "
+        f"{results['total_errors']} errors, {results['throughput_rps']} req/s"
+    )
+
+
+def main():
+    """Parse the arguments, seed, start the app and run the load."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file")
+    parser.add_argument("--users", type=int, default=200, help="seeded users")
+    parser.add_argument("--notes", type=int, default=20000, help="seeded notes")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra setting for the server, e.g. DB_BACKEND=async")
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95 slowdown against --baseline")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    process = None
+    workdir = None
+
+    if args.url:
+        base_url = args.url
+    else:
+        database_url = args.database_url
+        if database_url is None:
+            workdir = tempfile.TemporaryDirectory(prefix="note-bench-")
+            database_url = f"sqlite:///{workdir.name}/bench.sqlite3"
+        print(f"Seeding {args.users} users and {args.notes} notes into {database_url}")
+        seed(database_url, args.users, args.notes, args.seed)
+        if args.workers > 1 and "SESSION_STORE" not in env:
+            # the memory store is per process, the workers must share sessions
+            workdir = workdir or tempfile.TemporaryDirectory(prefix="note-bench-")
+            env["SESSION_STORE"] = "sqlite"
+            env["SESSION_STORE_PATH"] = f"{workdir.name}/sessions.sqlite3"
+        port = free_port()
+        process = start_server(database_url, port, args.workers, env)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        print(f"Running {args.concurrency} virtual users for {args.duration}s on {base_url}")
+        results = asyncio.run(drive(
+            base_url, args.concurrency, args.duration, args.notes, args.seed
+        ))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if workdir is not None:
+            workdir.cleanup()
+
+    results["config"] = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "users": args.users,
+        "notes": args.notes,
+        "workers": args.workers,
+        "env": env,
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.max_regression)
+        if regressions:
+            print(f"p95 regressions above {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""rows.py
+
+Rows/sec of the list and search responses, ORM path against column path.
+
+    python -m benchmarks.rows --notes 20000 --page 500 --rounds 20
+
+Both paths run the same page queries on a seeded SQLite database and render
+the JSON body the route would send:
+
+- orm: whole NoteDb/UserDb entities, validated into the response models and
+  serialized by FastAPI, as the routes did before the column path;
+- columns: only the columns of the response models, as dicts, rendered by
+  RowsResponse without validation.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.load import ROOT, seed
+
+
+def measure(run, rounds: int) -> tuple:
+    """Best time of `rounds` runs of `run`, and the rows it returned."""
+    best, rows = float("inf"), 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        rows = run()
+        best = min(best, time.perf_counter() - start)
+    return best, rows
+
+
+def main(argv: list = None):
+    """Seed a database, time both paths and print their rows/sec."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--notes", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=500, help="rows per response")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="notes-rows-"), "rows.sqlite3")
+    database_url = f"sqlite:///{path}"
+    seed(database_url, args.users, args.notes, args.seed)
+
+    sys.path.insert(0, ROOT)
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from api.database import NoteDb, UserDb, SessionLocal, init_engine, dispose_engine
+    from api.models.notes import NoteDetails, NOTE_COLUMNS
+    from api.models.users import BaseUser, USER_COLUMNS
+    from api.utils.responses import RowsResponse
+    from api.utils.search import search_query
+
+    init_engine()
+    notes_adapter = TypeAdapter(list[NoteDetails])
+    users_adapter = TypeAdapter(list[BaseUser])
+
+    def orm(query, adapter):
+        def run():
+            with SessionLocal() as sess:
+                rows = query(sess).limit(args.page).all()
+                body = adapter.validate_python(rows, from_attributes=True)
+                JSONResponse(adapter.dump_python(body, mode="json"))
+                return len(rows)
+        return run
+
+    def columns(query, selected):
+        def run():
+            with SessionLocal() as sess:
+                rows = [
+                    row._asdict()
+                    for row in query(sess).with_entities(*selected).limit(args.page)
+                ]
+                RowsResponse(rows)
+                return len(rows)
+        return run
+
+    cases = [
+        ("notes list", lambda sess: sess.query(NoteDb), notes_adapter, NOTE_COLUMNS),
+        (
+            "notes search",
+            lambda sess: search_query(sess, "content", "a"),
+            notes_adapter, NOTE_COLUMNS,
+        ),
+        ("users list", lambda sess: sess.query(UserDb), users_adapter, USER_COLUMNS),
+    ]
+
+    print(f"{'case':<14}{'rows':>6}{'orm rows/s':>14}{'cols rows/s':>14}{'gain':>8}")
+    for name, query, adapter, selected in cases:
+        orm_time, rows = measure(orm(query, adapter), args.rounds)
+        cols_time, _ = measure(columns(query, selected), args.rounds)
+        print(
+            f"{name:<14}{rows:>6}{rows / orm_time:>14.0f}"
+            f"{rows / cols_time:>14.0f}{orm_time / cols_time:>7.2f}x"
+        )
+
+    dispose_engine()
+
+
+if __name__ == "__main__":
+    main()
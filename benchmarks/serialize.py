@@ -0,0 +1,81 @@
+"""serialize.py
+
+JSON serialization throughput of a large note list response.
+
+    python -m benchmarks.serialize --notes 10000 --rounds 20
+
+Encodes the same `list[NoteDetails]` payload, built as the rows of the
+column path, with each encoder the app can use and checks they all
+produce the same bytes:
+
+- jsonable_encoder: FastAPI's default for routes without a response model;
+- pydantic: validation into NoteDetails then `dump_json`, FastAPI's path
+  for routes with a response model;
+- json / orjson: the JSON_BACKEND encoders of FastJSONResponse.
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.load import ROOT, sentence
+
+
+def main(argv: list = None):
+    """Time every encoder on the same payload and print their throughput."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from api.models.notes import NoteDetails
+    from api.utils.responses import JSON_BACKENDS, orjson
+
+    rng = random.Random(args.seed)
+    now = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    notes = [
+        {
+            "user_id": rng.randint(1, 200),
+            "title": sentence(rng, 3),
+            "content": sentence(rng, rng.randint(20, 200)),
+            "time_created": now - timedelta(seconds=i),
+            "time_edition": now,
+            "id": i + 1,
+        }
+        for i in range(args.notes)
+    ]
+    adapter = TypeAdapter(list[NoteDetails])
+
+    encoders = {
+        "jsonable_encoder": lambda: JSONResponse(jsonable_encoder(notes)).body,
+        "pydantic": lambda: adapter.dump_json(adapter.validate_python(notes)),
+    }
+    for name, backend in JSON_BACKENDS.items():
+        if name == "orjson" and orjson is None:
+            continue
+        encoders[name] = lambda backend=backend(): backend.dumps(notes)
+
+    expected = encoders["jsonable_encoder"]()
+    print(f"{args.notes} notes, {len(expected) / 1e6:.1f} MB per payload")
+    print(f"{'encoder':<18}{'ms':>9}{'notes/s':>12}{'MB/s':>9}{'same bytes':>12}")
+    for name, encode in encoders.items():
+        best = float("inf")
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            body = encode()
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"{name:<18}{best * 1000:>9.1f}{args.notes / best:>12.0f}"
+            f"{len(body) / best / 1e6:>9.0f}{str(body == expected):>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
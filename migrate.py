@@ -0,0 +1,8 @@
+"""migrate.py"""
+
+import sys
+from api.migrations import main
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
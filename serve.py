@@ -0,0 +1,8 @@
+"""serve.py"""
+
+import sys
+from api.server import main
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))